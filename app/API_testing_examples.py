@@ -108,7 +108,7 @@ async def test_api():
         print("6️⃣ Fetching all books as user...")
         user_headers = {"Authorization": f"Bearer {user_token}"}
         async with session.get(f"{BASE_URL}/books", headers=user_headers) as resp:
-            books = await resp.json()
+            books = (await resp.json())["items"]
             print(f"   ✅ Found {len(books)} books")
             for book in books:
                 print(f"      📖 {book['title']} by {book['author']} ({book['available_copies']}/{book['total_copies']} available)")
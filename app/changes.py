@@ -0,0 +1,143 @@
+# app/changes.py
+"""Change sequence numbers for catalog writes and the /books/changes delta feed.
+
+Every write to a book (add, update, bulk import, borrow, return, releases of
+a deleted user's loans) stamps `seq` on the document via `stamp()`. Deletes
+leave a tombstone {_id: book id, seq, deleted_at} that a TTL index expires
+after TOMBSTONE_TTL_DAYS. Role changes and deletes of users are stamped and
+tombstoned the same way; the feed skips them.
+
+`seq` is a hybrid clock: wall-clock microseconds, bumped to stay strictly
+increasing within a worker. Workers are not coordinated, so a write stamped
+now may commit after a write stamped slightly later by another worker. The
+feed therefore only serves changes older than CHANGES_SETTLE_SECONDS; by
+then every write stamped at or before that point is assumed visible. Ties
+between workers are broken by _id, the feed being a keyset over (seq, _id).
+
+A sync token is opaque to clients: the (seq, _id) position plus the time
+the client was last fully caught up. Deletes newer than that time are still
+tombstoned, so a token older than the tombstone TTL gets 410 and the client
+must start over without a token.
+"""
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from fastapi import HTTPException, status
+from pymongo.errors import BulkWriteError
+
+from app.dependencies import (
+    books_col, tombstones_col, keyset_filter, CHANGES_SETTLE_SECONDS, TOMBSTONE_TTL_DAYS
+)
+
+DUPLICATE_KEY = 11000
+_MAX_ID = ObjectId("f" * 24)  # sorts after every real _id with the same seq
+_SORT = [("seq", 1), ("_id", 1)]
+
+_last_seq = 0
+
+
+def _now_us() -> int:
+    return time.time_ns() // 1000
+
+
+def next_seq() -> int:
+    """Microseconds since the epoch, strictly increasing within this process."""
+    global _last_seq
+    _last_seq = max(_now_us(), _last_seq + 1)
+    return _last_seq
+
+
+def stamp(update: Any) -> Any:
+    """Return `update` (an update document or pipeline) that also sets a fresh seq."""
+    seq = {"seq": next_seq()}
+    if isinstance(update, list):
+        return update + [{"$set": seq}]
+    return {**update, "$set": {**update.get("$set", {}), **seq}}
+
+
+def tombstone(book: Dict[str, Any]) -> Dict[str, Any]:
+    return {"_id": book["_id"], "collection": "books", "seq": next_seq(), "deleted_at": datetime.now(timezone.utc)}
+
+
+def user_tombstone(user: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    """Deleted users are tombstoned too, for the polling mode of app/invalidation.py."""
+    return {
+        "_id": user["_id"], "collection": "users", "user_id": user_id,
+        "seq": next_seq(), "deleted_at": datetime.now(timezone.utc),
+    }
+
+
+async def insert_tombstones(docs: List[Dict[str, Any]]) -> None:
+    """Insert tombstones, skipping any already written for the same _id."""
+    if not docs:
+        return
+    try:
+        await tombstones_col.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        if e.details.get("writeConcernErrors") or any(
+            error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])
+        ):
+            raise
+
+
+async def stamp_unsequenced_books() -> int:
+    """Give books written before seq existed seq=0, so a full sync includes them."""
+    result = await books_col.update_many({"seq": {"$exists": False}}, {"$set": {"seq": 0}})
+    return result.modified_count
+
+
+# --- Sync tokens ---
+def encode_token(seq: int, last_id: ObjectId, caught_up: int) -> str:
+    raw = json.dumps({"s": seq, "id": str(last_id), "c": caught_up}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_token(token: str) -> Tuple[int, ObjectId, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return int(payload["s"]), ObjectId(payload["id"]), int(payload["c"])
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid sync token")
+
+
+async def read_changes(since: Optional[str], limit: int) -> Dict[str, Any]:
+    """Books written and ids deleted after `since`, oldest first, plus the next token."""
+    now = _now_us()
+    settled = now - int(CHANGES_SETTLE_SECONDS * 1e6)
+    window: Dict[str, Any] = {"seq": {"$lte": settled}, "collection": {"$ne": "users"}}
+    if since:
+        seq, last_id, caught_up = decode_token(since)
+        if caught_up < now - TOMBSTONE_TTL_DAYS * 86400 * 10**6:
+            raise HTTPException(
+                status_code=status.HTTP_410_GONE,
+                detail="Sync token expired; sync again without a token"
+            )
+        window = {"$and": [window, keyset_filter("seq", seq, last_id)]}
+    else:
+        seq, last_id, caught_up = -1, _MAX_ID, now  # nothing held, nothing to delete
+
+    books, deleted = await asyncio.gather(
+        books_col.find(window).sort(_SORT).limit(limit + 1).to_list(length=limit + 1),
+        tombstones_col.find(window).sort(_SORT).limit(limit + 1).to_list(length=limit + 1),
+    )
+    merged: List[Dict[str, Any]] = sorted(books + deleted, key=lambda doc: (doc["seq"], doc["_id"]))
+    page, has_more = merged[:limit], len(merged) > limit
+
+    if has_more:
+        next_since = encode_token(page[-1]["seq"], page[-1]["_id"], caught_up)
+    elif settled > seq:
+        next_since = encode_token(settled, _MAX_ID, settled)
+    else:  # this worker's clock is behind the token's; keep the position
+        next_since = encode_token(seq, last_id, caught_up)
+
+    return {
+        "items": [doc for doc in page if "deleted_at" not in doc],
+        "deleted": [str(doc["_id"]) for doc in page if "deleted_at" in doc],
+        "next_since": next_since,
+        "has_more": has_more,
+    }
@@ -0,0 +1,174 @@
+# app/db_indexes.py
+"""Declared MongoDB indexes and a reconciler that provisions them.
+
+Runs from `lifespan` on startup, or by hand as a management command:
+
+    python -m app.db_indexes          # create missing indexes, report drift
+    python -m app.db_indexes --check  # report drift only, change nothing
+    python -m app.db_indexes --fix    # also drop + recreate mismatched indexes
+"""
+import argparse
+import asyncio
+from typing import Any, Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from app.dependencies import users_col, books_col, loans_col, stats_col, tombstones_col, TOMBSTONE_TTL_DAYS
+
+# Options that make two indexes with the same key pattern different
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "weights")
+
+INDEX_SPECS: List[Tuple[Any, List[IndexModel]]] = [
+    (users_col, [
+        # login/signup lookups; also makes signup race-free
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        # get_current_user runs this on every authenticated request. Legacy
+        # documents have no user_id, so only string values are constrained.
+        IndexModel(
+            [("user_id", ASCENDING)], name="user_id_unique", unique=True,
+            partialFilterExpression={"user_id": {"$type": "string"}},
+        ),
+        # Role changes since the last poll (app/invalidation.py, polling mode)
+        IndexModel(
+            [("seq", ASCENDING)], name="seq",
+            partialFilterExpression={"seq": {"$exists": True}},
+        ),
+    ]),
+    (books_col, [
+        # (sort key, _id) pairs back the keyset-paginated listings
+        IndexModel([("title", ASCENDING), ("_id", ASCENDING)], name="title_id"),
+        IndexModel([("author", ASCENDING), ("_id", ASCENDING)], name="author_id"),
+        IndexModel([("genre", ASCENDING), ("_id", ASCENDING)], name="genre_id"),
+        # bulk import upserts by ISBN; books without one store null and are skipped
+        IndexModel(
+            [("isbn", ASCENDING)], name="isbn",
+            partialFilterExpression={"isbn": {"$type": "string"}},
+        ),
+        IndexModel(
+            [("title", TEXT), ("author", TEXT), ("genre", TEXT), ("description", TEXT)],
+            name="books_text",
+            weights={"title": 10, "author": 5, "genre": 3, "description": 1},
+        ),
+        # /books/changes reads writes in (seq, _id) order
+        IndexModel([("seq", ASCENDING), ("_id", ASCENDING)], name="seq_id"),
+    ]),
+    (loans_col, [
+        # One open loan per (user, book); also serves /mybooks by user_id prefix
+        IndexModel(
+            [("user_id", ASCENDING), ("book_id", ASCENDING)], name="active_user_book_unique",
+            unique=True, partialFilterExpression={"active": True},
+        ),
+        # Admin listing of active/overdue loans, keyset-paginated by due date
+        IndexModel(
+            [("due_at", ASCENDING), ("_id", ASCENDING)], name="active_due_id",
+            partialFilterExpression={"active": True},
+        ),
+        # Who holds book X
+        IndexModel(
+            [("book_id", ASCENDING), ("_id", ASCENDING)], name="active_book_id",
+            partialFilterExpression={"active": True},
+        ),
+        # Loans claimed by one release_loans call (only deleted users' loans carry closed_by)
+        IndexModel(
+            [("closed_by", ASCENDING)], name="closed_by",
+            partialFilterExpression={"closed_by": {"$exists": True}},
+        ),
+    ]),
+    (tombstones_col, [
+        IndexModel([("seq", ASCENDING), ("_id", ASCENDING)], name="seq_id"),
+        # Deletes are remembered for TOMBSTONE_TTL_DAYS; older sync tokens get 410
+        IndexModel(
+            [("deleted_at", ASCENDING)], name="deleted_at_ttl",
+            expireAfterSeconds=TOMBSTONE_TTL_DAYS * 86400,
+        ),
+    ]),
+    (stats_col, [
+        # Top genres / top borrowers for the admin dashboard
+        IndexModel([("kind", ASCENDING), ("count", DESCENDING)], name="kind_count"),
+    ]),
+]
+
+
+def _normalize(definition: Dict[str, Any]) -> Dict[str, Any]:
+    """Reduce a spec document or index_information() entry to comparable form."""
+    key = definition["key"]
+    key = list(key.items()) if hasattr(key, "items") else list(key)
+    if any(direction == TEXT for _, direction in key) or key[0][0] == "_fts":
+        # The server stores text indexes under _fts/_ftsx; compare weights instead
+        key = [("_fts", TEXT), ("_ftsx", 1)]
+    else:
+        key = [(field, int(direction)) for field, direction in key]
+    normalized = {"key": key}
+    for option in _COMPARED_OPTIONS:
+        if option in definition:
+            normalized[option] = definition[option]
+    return normalized
+
+
+async def reconcile_collection(collection, specs: List[IndexModel], apply: bool = True,
+                               fix: bool = False) -> Dict[str, List[str]]:
+    report: Dict[str, List[str]] = {"created": [], "missing": [], "mismatched": [], "extra": [], "errors": []}
+    existing = await collection.index_information()
+    declared = {spec.document["name"] for spec in specs}
+
+    for spec in specs:
+        name = spec.document["name"]
+        if name in existing:
+            if _normalize(existing[name]) == _normalize(spec.document):
+                continue
+            report["mismatched"].append(name)
+            if not (apply and fix):
+                continue
+            await collection.drop_index(name)
+        elif not apply:
+            report["missing"].append(name)
+            continue
+
+        try:
+            await collection.create_indexes([spec])
+            report["created"].append(name)
+        except Exception as e:
+            # e.g. duplicate usernames already stored block a unique index
+            report["errors"].append(f"{name}: {e}")
+
+    report["extra"] = [name for name in existing if name != "_id_" and name not in declared]
+    return report
+
+
+async def ensure_indexes(apply: bool = True, fix: bool = False) -> Dict[str, Dict[str, List[str]]]:
+    """Reconcile every declared index; returns a per-collection drift report."""
+    reports = {}
+    for collection, specs in INDEX_SPECS:
+        reports[collection.name] = await reconcile_collection(collection, specs, apply=apply, fix=fix)
+    return reports
+
+
+def print_report(reports: Dict[str, Dict[str, List[str]]]) -> None:
+    for collection, report in reports.items():
+        if report["created"]:
+            print(f"✅ Created indexes on {collection}: {', '.join(report['created'])}")
+        if report["missing"]:
+            print(f"⚠️ Missing indexes on {collection}: {', '.join(report['missing'])}")
+        if report["mismatched"]:
+            print(f"⚠️ Index drift on {collection} (definition differs): {', '.join(report['mismatched'])}")
+        if report["extra"]:
+            print(f"ℹ️ Undeclared indexes on {collection}: {', '.join(report['extra'])}")
+        for error in report["errors"]:
+            print(f"❌ Could not create index on {collection}: {error}")
+
+
+async def _main() -> int:
+    parser = argparse.ArgumentParser(description="Provision and check MongoDB indexes")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--check", action="store_true", help="report drift without changing anything")
+    group.add_argument("--fix", action="store_true", help="drop and recreate mismatched indexes")
+    args = parser.parse_args()
+
+    reports = await ensure_indexes(apply=not args.check, fix=args.fix)
+    print_report(reports)
+    drift = any(r["missing"] or r["mismatched"] or r["errors"] for r in reports.values())
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(_main()))
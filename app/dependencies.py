@@ -1,16 +1,22 @@
 # sept 9th update
 # app/dependencies.py
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import base64
+import json
 import os
+import time
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 from fastapi import HTTPException, status
-from passlib.context import CryptContext
 import jwt
 
+# Password helpers live in app.passwords (pool-safe module); re-exported here
+from app.passwords import get_password_hash, verify_password, verify_and_update_password
+from app.metrics import mongo_event_listeners
+
 # --- Load env ---
 load_dotenv()
 MONGODB_URI = os.getenv("MONGODB_URI") # replace with your Atlas URI in Render env
@@ -19,28 +25,141 @@ MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "book_mgmt")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-super-secret-jwt-key-change-in-production")
 JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))  # 24 hours
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "1000"))
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", "1000"))
+# Lines one quoted CSV field may span before its row is rejected
+BULK_IMPORT_CSV_MAX_RECORD_LINES = int(os.getenv("BULK_IMPORT_CSV_MAX_RECORD_LINES", "100"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))  # 0 disables
+# "db": reload the user on every authenticated request (default)
+# "stateless": require_role trusts verified token claims, checked against revocations
+AUTH_MODE = os.getenv("AUTH_MODE", "db")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "50000"))
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "1024"))
+FACET_LIMIT = int(os.getenv("FACET_LIMIT", "20"))  # buckets per facet
+FACET_SEARCH_LIMIT = int(os.getenv("FACET_SEARCH_LIMIT", "5000"))  # search hits faceted over
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "300"))  # 0 disables
+# Project list responses straight from Mongo documents and encode with orjson (app/serialization.py)
+FAST_JSON = os.getenv("FAST_JSON", "false").lower() == "true"
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Request profiler: captures a sampled fraction of requests plus every slow one
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_SAMPLE_RATE = float(os.getenv("PROFILER_SAMPLE_RATE", "0.01"))
+PROFILER_SLOW_MS = float(os.getenv("PROFILER_SLOW_MS", "500"))
+PROFILER_INTERVAL_MS = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+PROFILER_DIR = os.getenv("PROFILER_DIR", "profiles")
+PROFILER_MAX_FILES = int(os.getenv("PROFILER_MAX_FILES", "200"))
+LOAN_PERIOD_DAYS = int(os.getenv("LOAN_PERIOD_DAYS", "14"))
+STATS_RECONCILE_SECONDS = float(os.getenv("STATS_RECONCILE_SECONDS", "3600"))  # 0 disables
+# Delta sync (/books/changes): how long a write may take to become visible,
+# and how long deletes are remembered (older tokens must resync)
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "2"))
+TOMBSTONE_TTL_DAYS = int(os.getenv("TOMBSTONE_TTL_DAYS", "30"))
+# Cross-worker cache invalidation: "auto" (change streams, else polling),
+# "change_streams", "polling" or "off" (single worker)
+INVALIDATION_MODE = os.getenv("INVALIDATION_MODE", "auto")
+INVALIDATION_POLL_SECONDS = float(os.getenv("INVALIDATION_POLL_SECONDS", "1"))
+INVALIDATION_POLL_LIMIT = int(os.getenv("INVALIDATION_POLL_LIMIT", "1000"))  # beyond: full resync
+EVENTS_MAX_IDS = int(os.getenv("EVENTS_MAX_IDS", "100"))  # books per /books/events stream
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", "60"))
+# Resolve ids that are not a user_id as a legacy _id. Turn off once
+# `python -m app.user_id_backfill` has run.
+LEGACY_ID_FALLBACK = os.getenv("LEGACY_ID_FALLBACK", "true").lower() == "true"
+
+# --- Mongo client settings (unset values keep the driver/URI defaults) ---
+# MONGO_MAX_POOL_SIZE / MONGO_MIN_POOL_SIZE: connections per worker process
+# MONGO_WAIT_QUEUE_TIMEOUT_MS: fail a checkout after waiting this long for a free connection
+# MONGO_READ_PREFERENCE: e.g. primary, primaryPreferred, secondaryPreferred, nearest
+# MONGO_COMPRESSORS: e.g. "zstd,snappy,zlib" (zstd/snappy need their python packages)
+# MONGO_SERVER_SELECTION_TIMEOUT_MS: how long an operation waits for a reachable server
+MONGO_CLIENT_OPTIONS = {
+    option: cast(os.environ[env])
+    for env, option, cast in (
+        ("MONGO_MAX_POOL_SIZE", "maxPoolSize", int),
+        ("MONGO_MIN_POOL_SIZE", "minPoolSize", int),
+        ("MONGO_WAIT_QUEUE_TIMEOUT_MS", "waitQueueTimeoutMS", int),
+        ("MONGO_READ_PREFERENCE", "readPreference", str),
+        ("MONGO_COMPRESSORS", "compressors", str),
+        ("MONGO_SERVER_SELECTION_TIMEOUT_MS", "serverSelectionTimeoutMS", int),
+    )
+    if os.getenv(env)
+}
+
+# --- DB client (one per worker process, created by init_client) ---
+# Nothing connects at import time: under `gunicorn --preload` the master
+# imports the app and forks, and a client must not cross a fork. Each
+# worker's lifespan calls init_client(); Motor opens connections lazily on
+# the first operation, so an unreachable Mongo does not block startup.
+_client: Optional[AsyncIOMotorClient] = None
+_client_pid: Optional[int] = None
+_collections: Dict[str, Any] = {}
+
+
+def init_client() -> AsyncIOMotorClient:
+    """Create this process's client, replacing one inherited across a fork."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _collections.clear()
+        _client = AsyncIOMotorClient(
+            MONGODB_URI,
+            event_listeners=mongo_event_listeners() if METRICS_ENABLED or PROFILER_ENABLED else [],
+            **MONGO_CLIENT_OPTIONS
+        )
+        _client_pid = os.getpid()
+    return _client
+
+
+def close_client() -> None:
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        _client.close()
+    _client, _client_pid = None, None
+    _collections.clear()
+
+
+def get_client() -> AsyncIOMotorClient:
+    """The current client; scripts and benchmarks that skip the lifespan get one on first use."""
+    return _client if _client is not None else init_client()
+
+
+def get_database():
+    return get_client()[MONGO_DB_NAME]
+
+
+def get_collection(name: str):
+    collection = _collections.get(name)
+    if collection is None:
+        collection = _collections[name] = get_database()[name]
+    return collection
+
+
+class _CollectionProxy:
+    """Module-level stand-in for a collection of whatever client is current.
 
-# --- DB client (module-level singleton; no cyclic import risk) ---
-try:
-    _client: AsyncIOMotorClient = AsyncIOMotorClient(MONGODB_URI)
-    _db = _client[MONGO_DB_NAME]
-    
-    users_col = _db["users"]
-    books_col = _db["books"]
-    
-    print(f"✅ Connected to MongoDB: {MONGO_DB_NAME}")
-except Exception as e:
-    print(f"❌ MongoDB connection error: {e}")
-    raise
+    Routers, db_indexes and the migration scripts import users_col & co. at
+    import time, before any client exists; attribute access is forwarded to
+    the real collection when it happens.
+    """
 
-# --- Password hashing ---
-_pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    def __init__(self, name: str):
+        self._name = name
 
-def get_password_hash(password: str) -> str:
-    return _pwd_context.hash(password)
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(get_collection(self._name), attr)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return _pwd_context.verify(plain_password, hashed_password)
+    def __repr__(self) -> str:
+        return f"<collection proxy {MONGO_DB_NAME}.{self._name}>"
+
+
+users_col = _CollectionProxy("users")
+books_col = _CollectionProxy("books")
+loans_col = _CollectionProxy("loans")
+stats_col = _CollectionProxy("stats")  # materialized dashboard counters (app/stats.py)
+migrations_col = _CollectionProxy("migrations")  # checkpoints of resumable data migrations
+tombstones_col = _CollectionProxy("tombstones")  # deleted book ids for the changes feed
 
 # --- JWT helpers ---
 def create_access_token(data: Dict[str, Any], expires_minutes: Optional[int] = None) -> str:
@@ -48,7 +167,8 @@ def create_access_token(data: Dict[str, Any], expires_minutes: Optional[int] = N
     expire = datetime.now(timezone.utc) + timedelta(
         minutes=expires_minutes or ACCESS_TOKEN_EXPIRE_MINUTES
     )
-    to_encode.update({"exp": expire})
+    # Float iat so a token minted right after a revocation is not caught by it
+    to_encode.update({"exp": expire, "iat": time.time()})
     token = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return token
 
@@ -83,6 +203,26 @@ def to_object_id(id_str: str) -> ObjectId:
             detail="Invalid ID format"
         )
 
+def user_identity_filter(*user_ids: str) -> Dict[str, Any]:
+    """Match users by user_id, or by _id for legacy documents, in one query.
+
+    Shared by every lookup of a user by token subject or path id.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    query: Dict[str, Any] = {"user_id": ids[0]} if len(ids) == 1 else {"user_id": {"$in": ids}}
+    if LEGACY_ID_FALLBACK:
+        oids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+        if len(oids) == 1:
+            query = {"$or": [query, {"_id": oids[0]}]}
+        elif oids:
+            query = {"$or": [query, {"_id": {"$in": oids}}]}
+    return query
+
+def canonical_user_id(user: Dict[str, Any]) -> str:
+    """The id a user is known by: user_id, or str(_id) for legacy documents."""
+    user_id = user.get("user_id")
+    return user_id if isinstance(user_id, str) else str(user.get("_id", user.get("id")))
+
 def oid_to_str(doc: Dict[str, Any]) -> Dict[str, Any]:
     """Convert MongoDB _id to string 'id' for API responses."""
     if doc and "_id" in doc:
@@ -90,12 +230,89 @@ def oid_to_str(doc: Dict[str, Any]) -> Dict[str, Any]:
         del doc["_id"]
     return doc
 
+# --- Keyset pagination helpers ---
+def encode_cursor(sort_key: str, doc: Dict[str, Any]) -> str:
+    """Build an opaque cursor pointing just past `doc` in `sort_key` order."""
+    payload = {"s": sort_key, "id": str(doc["_id"])}
+    if sort_key != "_id":
+        value = doc.get(sort_key)
+        if isinstance(value, datetime):
+            payload["t"], value = "date", value.isoformat()
+        payload["v"] = value
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_key: str) -> Tuple[Any, ObjectId]:
+    """Return the (sort value, _id) pair encoded by `encode_cursor`."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if payload["s"] != sort_key:
+            raise ValueError("cursor was issued for another sort key")
+        value = payload.get("v")
+        if payload.get("t") == "date":
+            value = datetime.fromisoformat(value)
+        return value, ObjectId(payload["id"])
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def keyset_filter(sort_key: str, value: Any, last_id: ObjectId) -> Dict[str, Any]:
+    """Match documents strictly after (value, last_id) in ascending order.
+
+    Missing/null sort values come first in MongoDB's ascending order and
+    cannot be compared with $gt, so they get their own branch.
+    """
+    if sort_key == "_id":
+        return {"_id": {"$gt": last_id}}
+    if value is None:
+        return {"$or": [
+            {sort_key: None, "_id": {"$gt": last_id}},
+            {sort_key: {"$ne": None}},
+        ]}
+    return {"$or": [
+        {sort_key: {"$gt": value}},
+        {sort_key: value, "_id": {"$gt": last_id}},
+    ]}
+
+async def fetch_page(
+    collection,
+    query: Dict[str, Any],
+    sort_key: str = "_id",
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Read one page ordered by (sort_key, _id) without skip/offset.
+
+    Returns the raw documents and the cursor for the next page (None on the
+    last page). One extra document is read to know whether a next page exists.
+    """
+    if after:
+        value, last_id = decode_cursor(after, sort_key)
+        query = {"$and": [query, keyset_filter(sort_key, value, last_id)]} if query else \
+            keyset_filter(sort_key, value, last_id)
+
+    sort = [("_id", 1)] if sort_key == "_id" else [(sort_key, 1), ("_id", 1)]
+    if projection and sort_key != "_id":
+        projection = {**projection, sort_key: 1}  # the next cursor is built from it
+    cursor = collection.find(query, projection).sort(sort).limit(limit + 1)
+    docs = await cursor.to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(sort_key, docs[-1])
+    return docs, next_cursor
+
 # --- Database health check ---
 async def check_database_health() -> Dict[str, str]:
     """Check if database connection is healthy."""
     try:
         # Simple ping to check connection
-        await _client.admin.command('ping')
+        await get_client().admin.command('ping')
         return {"status": "healthy", "database": MONGO_DB_NAME}
     except Exception as e:
         return {"status": "unhealthy", "error": str(e)}
@@ -0,0 +1,164 @@
+# app/events.py
+"""In-process pub/sub hub behind the /books/events Server-Sent Events stream.
+
+Routes publish a book's availability after they change it; every open stream
+subscribed to that book (or to the whole catalog) receives it. Events are
+state, not deltas: a subscriber keeps only the latest pending event per book,
+so a slow reader gets fewer, newer events instead of an ever-growing queue.
+If a subscriber still has more than EVENTS_MAX_PENDING distinct books
+pending, they are dropped and it gets a single `resync` event telling the
+client to re-read (GET /books/{id} or /books/changes).
+
+An idle subscription is a set entry, a small dict and an asyncio.Event, so a
+worker can hold thousands of them; publishing touches only the subscribers
+of that book plus the whole-catalog ones. The hub is per worker process;
+writes handled by other workers reach it through app/invalidation.py.
+
+Deliberately free of DB/app imports (app.metrics reads `event_hub_stats`).
+"""
+import asyncio
+import json
+import os
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+load_dotenv()
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_MAX_PENDING = int(os.getenv("EVENTS_MAX_PENDING", "1000"))  # per subscriber
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "10000"))  # per worker
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))  # client reconnect delay
+
+Event = Tuple[str, Dict[str, Any]]  # (SSE event name, data)
+
+
+def availability(book: Dict[str, Any]) -> Event:
+    """The availability event for a book document (defaults as in BookOut)."""
+    return "availability", {
+        "id": str(book["_id"]),
+        "total_copies": book.get("total_copies", 1),
+        "available_copies": book.get("available_copies", 1),
+        "available": book.get("available", True),
+    }
+
+
+def format_event(event: Event) -> str:
+    name, data = event
+    return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    __slots__ = ("book_ids", "pending", "resync", "wake", "active")
+
+    def __init__(self, book_ids: Optional[frozenset]):
+        self.book_ids = book_ids  # None: the whole catalog
+        self.pending: Dict[str, Event] = {}
+        self.resync = False
+        self.wake = asyncio.Event()
+        self.active = True
+
+    def offer(self, book_id: str, event: Event) -> bool:
+        """Queue `event`, replacing an older one for the same book. False on overflow."""
+        if self.resync:
+            return True  # everything is re-read anyway
+        self.pending.pop(book_id, None)
+        self.pending[book_id] = event
+        self.wake.set()
+        if len(self.pending) > EVENTS_MAX_PENDING:
+            self.pending.clear()
+            self.resync = True
+            return False
+        return True
+
+
+class EventHub:
+    def __init__(self):
+        self._by_book: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._catalog: Set[Subscription] = set()
+        self.subscribers = 0
+        self.published = 0
+        self.overflows = 0
+
+    def subscribe(self, book_ids: Optional[Iterable[str]] = None) -> Subscription:
+        if self.subscribers >= EVENTS_MAX_SUBSCRIBERS:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many event streams; try again later"
+            )
+        sub = Subscription(frozenset(book_ids) if book_ids is not None else None)
+        if sub.book_ids is None:
+            self._catalog.add(sub)
+        else:
+            for book_id in sub.book_ids:
+                self._by_book[book_id].add(sub)
+        self.subscribers += 1
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        """Idempotent: runs from the stream's cleanup and from the response's background task."""
+        if not sub.active:
+            return
+        sub.active = False
+        if sub.book_ids is None:
+            self._catalog.discard(sub)
+        else:
+            for book_id in sub.book_ids:
+                subs = self._by_book.get(book_id)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._by_book[book_id]
+        self.subscribers -= 1
+
+    def publish(self, book_id: str, event: Event) -> None:
+        targets = self._by_book.get(book_id, ())
+        if not targets and not self._catalog:
+            return
+        self.published += 1
+        for sub in (*targets, *self._catalog):
+            if not sub.offer(book_id, event):
+                self.overflows += 1
+
+    def publish_book(self, book: Dict[str, Any]) -> None:
+        self.publish(str(book["_id"]), availability(book))
+
+    def publish_deleted(self, book_id: str) -> None:
+        self.publish(book_id, ("deleted", {"id": book_id}))
+
+    def publish_resync(self) -> None:
+        """Tell every subscriber to re-read, e.g. after a bulk import."""
+        for sub in (*self._catalog, *{sub for subs in self._by_book.values() for sub in subs}):
+            sub.pending.clear()
+            sub.resync = True
+            sub.wake.set()
+
+    async def stream(self, sub: Subscription, initial: Iterable[Event] = ()) -> AsyncIterator[str]:
+        """SSE body for `sub`; unsubscribes when the client goes away."""
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n" + "".join(format_event(event) for event in initial)
+            while True:
+                try:
+                    await asyncio.wait_for(sub.wake.wait(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"  # keeps proxies from closing idle streams
+                    continue
+                sub.wake.clear()
+                if sub.resync:
+                    sub.resync = False
+                    yield format_event(("resync", {}))
+                    continue
+                events, sub.pending = list(sub.pending.values()), {}
+                # One write per wake-up; while it is blocked on a slow client,
+                # newer events coalesce in `pending`
+                yield "".join(format_event(event) for event in events)
+        finally:
+            self.unsubscribe(sub)
+
+
+hub = EventHub()
+
+
+def event_hub_stats() -> Dict[str, int]:
+    return {"subscribers": hub.subscribers, "published": hub.published, "overflows": hub.overflows}
@@ -0,0 +1,239 @@
+# app/invalidation.py
+"""Cross-worker invalidation of in-process state, driven by MongoDB itself.
+
+Each worker keeps state derived from the database: the auth user cache and
+token revocations (app/middleware/auth_middleware.py), catalog responses
+cached per catalog version, the search index and the SSE hub. The worker that
+handles a write updates its own state inline; this module applies the same
+write on every other worker. Applying a change twice is harmless, so the
+writer is not excluded.
+
+Two sources, picked by INVALIDATION_MODE:
+
+- change streams on users and books (replica sets, Atlas). They see every
+  write, including scripts and other services, and resume after a dropped
+  connection; if the resume point is gone, everything is resynced.
+- polling (standalone mongod, which has no change streams): every
+  INVALIDATION_POLL_SECONDS read the books, users and tombstones stamped
+  with a `seq` newer than the last poll (app/changes.py). Only writes made
+  through this app are stamped. The last CHANGES_SETTLE_SECONDS are re-read
+  to catch writes that committed late, skipping those already applied.
+
+"auto" tries change streams and falls back to polling when the server says
+they are unsupported. invalidation_lag_seconds measures write-to-applied.
+
+A change stream delete only carries the user's _id. The user_id that tokens
+carry is taken from the pre-image when the users collection has
+changeStreamPreAndPostImages enabled, else from this worker's user cache.
+"""
+import asyncio
+import time
+from datetime import timezone
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.cache import bump_catalog_version
+from app.dependencies import (
+    books_col, users_col, tombstones_col, CHANGES_SETTLE_SECONDS,
+    INVALIDATION_MODE, INVALIDATION_POLL_SECONDS, INVALIDATION_POLL_LIMIT
+)
+from app.events import hub
+from app.metrics import invalidation_events, invalidation_lag
+from app.middleware.auth_middleware import user_cache, invalidate_cached_user, revoke_user_tokens
+from app.search_index import book_index
+
+CHANGE_STREAMS_UNSUPPORTED = 40573  # "$changeStream stage is only supported on replica sets"
+CHANGE_STREAM_HISTORY_LOST = 286  # the resume point fell off the oplog
+RETRY_MAX_SECONDS = 30
+
+# Updates touching only these fields (borrow/return) leave the search index alone
+CIRCULATION_FIELDS = {"available_copies", "available", "total_copies", "seq"}
+
+
+# --- Applying changes ---
+def book_changed(book: Dict[str, Any], reindex: bool = True) -> None:
+    if reindex:
+        book_index.add(book)
+    hub.publish_book(book)
+    bump_catalog_version()
+
+
+def book_deleted(book_id: str) -> None:
+    book_index.remove(book_id)
+    hub.publish_deleted(book_id)
+    bump_catalog_version()
+
+
+def user_changed(user: Dict[str, Any], revoke: bool, at: float) -> None:
+    invalidate_cached_user(user)
+    if revoke:
+        revoke_user_tokens(user, at)
+
+
+def user_deleted(_id: Any, user_id: Optional[str], at: float) -> None:
+    # The cache is keyed by token subject, which may be a user_id we don't know
+    for cached in user_cache.invalidate_where(lambda user: user.get("id") == str(_id)):
+        user_id = user_id or cached.get("user_id")
+    user_changed({"_id": _id, "user_id": user_id}, revoke=True, at=at)
+
+
+async def resync() -> None:
+    """Start over after changes may have been missed."""
+    user_cache.clear()
+    bump_catalog_version()
+    hub.publish_resync()
+    await book_index.rebuild(books_col)
+
+
+def _observe(collection: str, operation: str, written_at: Optional[float]) -> None:
+    invalidation_events.inc((collection, operation))
+    if written_at is not None:
+        invalidation_lag.observe((collection,), max(0.0, time.time() - written_at))
+
+
+# --- Change streams ---
+def _written_at(change: Dict[str, Any]) -> Optional[float]:
+    wall_time = change.get("wallTime")  # MongoDB 6.0+
+    if wall_time is not None:
+        return wall_time.replace(tzinfo=timezone.utc).timestamp()
+    cluster_time = change.get("clusterTime")
+    return cluster_time.time if cluster_time is not None else None
+
+
+async def _on_book_change(change: Dict[str, Any]) -> None:
+    operation = change["operationType"]
+    if operation == "delete":
+        book_deleted(str(change["documentKey"]["_id"]))
+    elif operation in ("insert", "update", "replace"):
+        book = change.get("fullDocument")
+        if book is None:
+            return  # deleted since; its delete event follows
+        updated = change.get("updateDescription", {}).get("updatedFields", {})
+        book_changed(book, reindex=operation != "update" or bool(set(updated) - CIRCULATION_FIELDS))
+    else:  # drop, rename, invalidate
+        await resync()
+    _observe("books", operation, _written_at(change))
+
+
+async def _on_user_change(change: Dict[str, Any]) -> None:
+    operation = change["operationType"]
+    at = _written_at(change) or time.time()
+    _id = change.get("documentKey", {}).get("_id")
+    if operation == "update":
+        description = change.get("updateDescription", {})
+        fields = set(description.get("updatedFields", {})) | set(description.get("removedFields", []))
+        user_changed(change.get("fullDocument") or {"_id": _id}, revoke="role" in fields, at=at)
+    elif operation == "replace":
+        user_changed(change.get("fullDocument") or {"_id": _id}, revoke=True, at=at)
+    elif operation == "delete":
+        user_deleted(_id, (change.get("fullDocumentBeforeChange") or {}).get("user_id"), at)
+    else:  # drop, rename, invalidate
+        await resync()
+    _observe("users", operation, at)
+
+
+async def _watch(collection, handle, **options: Any) -> None:
+    """Apply `collection`'s change stream forever, resuming where it left off."""
+    resume_token = None
+    delay = 1.0
+    while True:
+        try:
+            async with collection.watch(resume_after=resume_token, **options) as stream:
+                delay = 1.0
+                async for change in stream:
+                    await handle(change)
+                    resume_token = stream.resume_token
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                raise
+            if e.code == CHANGE_STREAM_HISTORY_LOST:
+                print(f"⚠️ Warning: Change stream history lost, resyncing: {e}")
+                resume_token = None
+                await resync()
+                continue
+            print(f"⚠️ Warning: Change stream failed: {e} (retrying in {delay:.0f}s)")
+        except PyMongoError as e:
+            print(f"⚠️ Warning: Change stream failed: {e} (retrying in {delay:.0f}s)")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, RETRY_MAX_SECONDS)
+
+
+async def watch_change_streams() -> None:
+    tasks = [
+        asyncio.create_task(_watch(books_col, _on_book_change, full_document="updateLookup")),
+        asyncio.create_task(_watch(
+            users_col, _on_user_change,
+            pipeline=[{"$match": {"operationType": {"$ne": "insert"}}}],  # new users are never cached
+            full_document="updateLookup", full_document_before_change="whenAvailable",
+        )),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# --- Polling ---
+async def _apply_polled(source: str, doc: Dict[str, Any]) -> None:
+    at = doc["seq"] / 1e6
+    if source == "books":
+        book_changed(doc)
+        _observe("books", "update", at)
+    elif source == "users":
+        user_changed(doc, revoke=True, at=at)  # only role changes are stamped
+        _observe("users", "update", at)
+    elif doc.get("collection") == "users":
+        user_deleted(doc["_id"], doc.get("user_id"), at)
+        _observe("users", "delete", at)
+    else:
+        book_deleted(str(doc["_id"]))
+        _observe("books", "delete", at)
+
+
+async def poll_changes() -> None:
+    settle = int(CHANGES_SETTLE_SECONDS * 1e6)
+    floor = time.time_ns() // 1000 - settle  # state built at startup already covers the past
+    applied: Dict[Tuple[str, Any, int], int] = {}  # changes re-read within the settle window
+    limit = INVALIDATION_POLL_LIMIT + 1
+    while True:
+        await asyncio.sleep(INVALIDATION_POLL_SECONDS)
+        now = time.time_ns() // 1000
+        query = {"seq": {"$gt": floor}}
+        try:
+            batches = await asyncio.gather(
+                books_col.find(query).limit(limit).to_list(length=limit),
+                users_col.find(query, {"user_id": 1, "seq": 1}).limit(limit).to_list(length=limit),
+                tombstones_col.find(query).limit(limit).to_list(length=limit),
+            )
+            if any(len(docs) == limit for docs in batches):
+                await resync()  # a burst such as a bulk import
+                applied.clear()
+            else:
+                for source, docs in zip(("books", "users", "tombstones"), batches):
+                    for doc in docs:
+                        key = (source, doc["_id"], doc["seq"])
+                        if key not in applied:
+                            applied[key] = doc["seq"]
+                            await _apply_polled(source, doc)
+        except PyMongoError as e:
+            print(f"⚠️ Warning: Invalidation poll failed: {e}")
+            continue
+        floor = now - settle
+        for key in [key for key, seq in applied.items() if seq <= floor]:
+            del applied[key]
+
+
+async def run_invalidation() -> None:
+    """Started from `lifespan` unless INVALIDATION_MODE=off."""
+    if INVALIDATION_MODE in ("auto", "change_streams"):
+        try:
+            print("✅ Cache invalidation: watching change streams")
+            await watch_change_streams()
+        except OperationFailure as e:
+            if INVALIDATION_MODE != "auto" or e.code != CHANGE_STREAMS_UNSUPPORTED:
+                raise
+            print("ℹ️ Change streams unavailable (standalone mongod?); polling instead")
+    print(f"✅ Cache invalidation: polling every {INVALIDATION_POLL_SECONDS}s")
+    await poll_changes()
@@ -0,0 +1,105 @@
+# app/loans.py
+"""Loan records: one document per borrow in the `loans` collection.
+
+    {user_id, book_id, borrowed_at, due_at, returned_at, active}
+
+`active` is true until the copy is returned. A partial unique index on
+(user_id, book_id) over active loans is what stops a user from holding the
+same book twice, and the (due_at, _id) index over active loans backs the
+admin active/overdue listing. Closed loans are kept as history.
+
+The book side of a loan is the available_copies counter, adjusted with the
+update pipelines below.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List
+import uuid
+
+from pymongo import UpdateOne
+
+from app import stats
+from app.cache import bump_catalog_version
+from app.changes import stamp
+from app.events import hub
+from app.dependencies import books_col, loans_col, LOAN_PERIOD_DAYS
+
+
+# A copy can be taken while available_copies > 0. Legacy documents that predate
+# the counters only carry the `available` flag and count as a single copy.
+BORROWABLE = {"$or": [
+    {"available_copies": {"$gt": 0}},
+    {"available_copies": {"$exists": False}, "available": {"$ne": False}},
+]}
+# Update pipelines: counters are adjusted and `available` re-derived server-side
+TAKE_COPY = [
+    {"$set": {
+        "total_copies": {"$ifNull": ["$total_copies", 1]},
+        "available_copies": {"$subtract": [{"$ifNull": ["$available_copies", 1]}, 1]},
+    }},
+    {"$set": {"available": {"$gt": ["$available_copies", 0]}}},
+]
+def return_copies(count: int) -> list:
+    """Pipeline putting `count` copies back, never above total_copies."""
+    return [
+        {"$set": {"total_copies": {"$ifNull": ["$total_copies", 1]}}},
+        {"$set": {"available_copies": {
+            "$min": [{"$add": [{"$ifNull": ["$available_copies", 0]}, count]}, "$total_copies"]
+        }}},
+        {"$set": {"available": {"$gt": ["$available_copies", 0]}}},
+    ]
+
+RETURN_COPY = return_copies(1)
+
+
+def new_loan(user_id: str, book_id: Any) -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    return {
+        "user_id": user_id,
+        "book_id": book_id,
+        "borrowed_at": now,
+        "due_at": now + timedelta(days=LOAN_PERIOD_DAYS),
+        "returned_at": None,
+        "active": True,
+    }
+
+
+async def borrowed_by_user(user_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """Book ids (as strings) each user currently holds, in one query."""
+    ids = list(user_ids)
+    held: Dict[str, List[str]] = defaultdict(list)
+    if not ids:
+        return held
+    query = {"user_id": ids[0] if len(ids) == 1 else {"$in": ids}, "active": True}
+    async for loan in loans_col.find(query, {"user_id": 1, "book_id": 1}):
+        held[loan["user_id"]].append(str(loan["book_id"]))
+    return held
+
+
+async def release_loans(user_ids: List[str]) -> int:
+    """Close the active loans of (deleted) users and put their copies back.
+
+    Loans are claimed (closed under a marker unique to this call) before they
+    are counted, so a loan closed meanwhile by an overlapping delete or an
+    in-flight return is never put back twice.
+    """
+    if not user_ids:
+        return 0
+    marker = f"user_deleted:{uuid.uuid4()}"
+    result = await loans_col.update_many(
+        {"user_id": {"$in": user_ids}, "active": True},
+        {"$set": {"active": False, "returned_at": datetime.now(timezone.utc), "closed_by": marker}}
+    )
+    if not result.modified_count:
+        return 0
+    holds = Counter([loan["book_id"] async for loan in loans_col.find({"closed_by": marker}, {"book_id": 1})])
+    await books_col.bulk_write(
+        [UpdateOne({"_id": book_id}, stamp(return_copies(n))) for book_id, n in holds.items()], ordered=False
+    )
+    bump_catalog_version()
+    if hub.subscribers:
+        async for book in books_col.find({"_id": {"$in": list(holds)}}):
+            hub.publish_book(book)
+    released = sum(holds.values())
+    stats.record(stats.catalog(available_copies=released, active_loans=-released))
+    return released
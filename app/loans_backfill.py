@@ -0,0 +1,83 @@
+# app/loans_backfill.py
+"""Move embedded `borrowed_books` arrays into the `loans` collection.
+
+Before loans had their own collection, a user's loans were a string array of
+book ids on the user document. Run this once after deploying the loans
+collection; until then, those loans do not show up in /mybooks and cannot be
+returned.
+
+    python -m app.loans_backfill            # migrate (safe to rerun / resume)
+    python -m app.loans_backfill --dry-run  # count users still to migrate
+
+Each user is migrated by upserting one active loan per book (the partial
+unique index makes this idempotent) and then unsetting the array, so an
+interrupted run simply resumes with the users that still have one. The
+original borrow time is unknown: borrowed_at is the migration time and the
+loan gets a fresh LOAN_PERIOD_DAYS due date.
+"""
+import argparse
+import asyncio
+from typing import Dict
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from app.dependencies import users_col, loans_col, canonical_user_id
+from app.loans import new_loan
+
+HAS_EMBEDDED_LOANS = {"borrowed_books.0": {"$exists": True}}
+
+
+async def backfill_loans(batch_size: int = 500) -> Dict[str, int]:
+    users = loans = skipped = 0
+    while True:
+        batch = await users_col.find(HAS_EMBEDDED_LOANS, {"user_id": 1, "borrowed_books": 1}) \
+            .sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        upserts = []
+        for user in batch:
+            uid = canonical_user_id(user)
+            for bid in dict.fromkeys(user["borrowed_books"]):
+                if not ObjectId.is_valid(bid):
+                    skipped += 1
+                    continue
+                loan = new_loan(uid, ObjectId(bid))
+                key = {"user_id": uid, "book_id": loan.pop("book_id"), "active": True}
+                del loan["user_id"], loan["active"]
+                upserts.append(UpdateOne(key, {"$setOnInsert": {**loan, "migrated": True}}, upsert=True))
+        if upserts:
+            result = await loans_col.bulk_write(upserts, ordered=False)
+            loans += result.upserted_count
+
+        # Only after the loans exist; users whose array changed meanwhile are retried
+        await users_col.bulk_write([
+            UpdateOne({"_id": user["_id"], "borrowed_books": user["borrowed_books"]},
+                      {"$unset": {"borrowed_books": ""}})
+            for user in batch
+        ], ordered=False)
+        users += len(batch)
+        print(f"… {users} users migrated, {loans} loans created")
+
+    return {"users": users, "loans": loans, "skipped_invalid_ids": skipped}
+
+
+async def _main() -> int:
+    parser = argparse.ArgumentParser(description="Move borrowed_books arrays into the loans collection")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="count users to migrate, change nothing")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        print(f"ℹ️ Users with embedded borrowed_books: {await users_col.count_documents(HAS_EMBEDDED_LOANS)}")
+        return 0
+
+    result = await backfill_loans(args.batch_size)
+    print(f"✅ Migrated {result['users']} users into {result['loans']} loans"
+          f" ({result['skipped_invalid_ids']} invalid book ids skipped)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(_main()))
@@ -1,44 +1,133 @@
 #sept 8th update
 # app/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
 import uuid
 
 from app.routers.auth import auth_router
 from app.routers.books import books_router
 from app.routers.admin_books import admin_books_router
 from app.routers.admin_users import admin_users_router
-from app.dependencies import check_database_health, users_col, get_password_hash
+from app.routers.admin_loans import admin_loans_router
+from app.routers.admin_stats import admin_stats_router
+from app.dependencies import (
+    check_database_health, init_client, close_client, users_col, books_col, get_password_hash,
+    METRICS_ENABLED, PROFILER_ENABLED, STATS_RECONCILE_SECONDS, STARTUP_RETRY_MAX_SECONDS,
+    MONGO_DB_NAME, INVALIDATION_MODE
+)
+from app.passwords import shutdown_password_pool
+from app.db_indexes import ensure_indexes, print_report
+from app.middleware.auth_middleware import require_role, load_revocations
+from app.middleware.metrics_middleware import MetricsMiddleware
+from app.middleware.profiler_middleware import ProfilerMiddleware
+from app.metrics import render_metrics
+from app.cache import cache_stats
 from app.schemas import HealthResponse
+from app.search_index import book_index
+from app.stats import reconcile_periodically
+from app.changes import stamp_unsequenced_books
+from app.invalidation import run_invalidation
+
+async def provision_indexes():
+    """Provision declared indexes and report drift"""
+    print_report(await ensure_indexes())
+
+
+async def backfill_seq():
+    """Books written before the changes feed get seq=0"""
+    stamped = await stamp_unsequenced_books()
+    if stamped:
+        print(f"✅ Stamped {stamped} books for the changes feed")
+
+
+async def seed_admin():
+    """Create the default admin if it doesn't exist"""
+    existing_admin = await users_col.find_one({"username": "admin"})
+    if not existing_admin:
+        admin_user = {
+            "user_id": str(uuid.uuid4()),
+            "username": "admin",
+            "email": "admin@bookstore.com",
+            "full_name": "System Administrator",
+            "password": await get_password_hash("admin123"),
+            "role": "admin"
+        }
+        await users_col.insert_one(admin_user)
+        print("✅ Default admin user created: admin/admin123")
+    else:
+        print("✅ Admin user already exists")
+
+
+async def restore_revocations():
+    """Stateless tokens of users demoted or deleted before this worker started"""
+    revoked = await load_revocations()
+    print(f"✅ Token revocations loaded: {revoked}")
+
+
+async def build_search_index():
+    indexed = await book_index.rebuild(books_col)
+    print(f"✅ Search index built: {indexed} books")
+
+
+async def run_startup_tasks():
+    """Database work the worker needs once, run after it starts serving.
+
+    Each step is retried with backoff, so a worker that comes up while Mongo
+    is unreachable catches up once it is back instead of failing to boot.
+    """
+    steps = [
+        ("load token revocations", restore_revocations),
+        ("provision indexes", provision_indexes),
+        ("stamp books for the changes feed", backfill_seq),
+        ("create admin user", seed_admin),
+        ("build search index", build_search_index),
+    ]
+    for name, step in steps:
+        delay = 1.0
+        while True:
+            try:
+                await step()
+                break
+            except Exception as e:
+                print(f"⚠️ Warning: Could not {name}: {e} (retrying in {delay:.0f}s)")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+    print("✅ Startup tasks complete")
+
 
-# Create default admin user on startup
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
-    # Startup: Create default admin if doesn't exist
-    try:
-        existing_admin = await users_col.find_one({"username": "admin"})
-        if not existing_admin:
-            admin_user = {
-                "user_id": str(uuid.uuid4()),
-                "username": "admin",
-                "email": "admin@bookstore.com",
-                "full_name": "System Administrator",
-                "password": get_password_hash("admin123"),
-                "role": "admin",
-                "borrowed_books": []
-            }
-            await users_col.insert_one(admin_user)
-            print("✅ Default admin user created: admin/admin123")
-        else:
-            print("✅ Admin user already exists")
-    except Exception as e:
-        print(f"⚠️ Warning: Could not create admin user: {e}")
+    # Startup: one Mongo client per worker process (connects on first use)
+    init_client()
+    print(f"✅ MongoDB client ready: {MONGO_DB_NAME}")
+
+    # Startup: indexes, default admin and search index, without delaying startup
+    # (await app.state.startup to wait for them, as the benchmarks do)
+    app.state.startup = asyncio.create_task(run_startup_tasks())
+
+    # Startup: Reconcile dashboard counters now and then periodically
+    stats_task = None
+    if STATS_RECONCILE_SECONDS > 0:
+        stats_task = asyncio.create_task(reconcile_periodically(STATS_RECONCILE_SECONDS))
+
+    # Startup: Apply writes made by other workers to this worker's caches
+    invalidation_task = None
+    if INVALIDATION_MODE != "off":
+        invalidation_task = asyncio.create_task(run_invalidation())
     
     yield
     # Shutdown: cleanup if needed
+    app.state.startup.cancel()
+    for task in (stats_task, invalidation_task):
+        if task is not None:
+            task.cancel()
+    close_client()
+    shutdown_password_pool()
     print("📚 Book Management System shutting down...")
 
 # Initialize FastAPI app with lifespan events
@@ -65,11 +154,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Sampled/slow request profiles written to PROFILER_DIR (opt-in)
+if PROFILER_ENABLED:
+    app.add_middleware(ProfilerMiddleware)
+
+# Request metrics (outermost, so CORS preflights are counted too)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Include all routers
 app.include_router(auth_router)
 app.include_router(books_router)
 app.include_router(admin_books_router)
 app.include_router(admin_users_router)
+app.include_router(admin_loans_router)
+app.include_router(admin_stats_router)
 
 # Root endpoint
 @app.get("/")
@@ -105,4 +204,16 @@ async def api_info():
             "Admin user management",
             "Role-based access control"
         ]
-    }
\ No newline at end of file
+    }
+
+# In-process cache counters (per worker)
+@app.get("/api/v1/admin/cache/stats")
+async def get_cache_stats(admin=Depends(require_role("admin"))):
+    """Hit/miss/eviction counters for this worker's caches"""
+    return cache_stats()
+
+# Prometheus scrape endpoint
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
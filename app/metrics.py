@@ -0,0 +1,292 @@
+# app/metrics.py
+"""Pre-aggregated Prometheus-style metrics and their text exposition.
+
+Histograms keep fixed bucket counters per label set, so recording a value is
+a dict lookup plus a bisect; nothing is stored per observation. Gauges that
+mirror state owned elsewhere (bcrypt pool, caches, Mongo pool) are read by
+callback at scrape time instead of being pushed on every change.
+
+Mongo timings come from pymongo's command monitoring: `mongo_event_listeners()`
+is passed to the AsyncIOMotorClient created by app.dependencies.init_client. Listener callbacks
+run on Motor's executor threads, hence the locks. The same listener feeds the
+"db" phase of the request profiler (app/profiling.py).
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from pymongo import monitoring
+
+from app.cache import cache_stats
+from app.events import event_hub_stats
+from app.passwords import password_pool_stats
+from app.profiling import record_phase
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List[Any] = []
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: Dict[Tuple[Any, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, labels: Tuple[Any, ...] = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = buckets
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series: Dict[Tuple[Any, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, labels: Tuple[Any, ...], value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            cumulative += series[-2]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class GaugeFunc:
+    """Gauge whose samples are produced by `fn` at scrape time: {label values: value}."""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...],
+                 fn: Callable[[], Dict[Tuple[Any, ...], float]], kind: str = "gauge"):
+        self.name, self.help, self.labelnames, self.fn, self.kind = name, help, labelnames, fn, kind
+        _registry.append(self)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in self.fn().items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------------
+# HTTP
+# -------------------------------
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+
+# -------------------------------
+# MongoDB commands and pool
+# -------------------------------
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("collection", "command")
+)
+mongo_command_failures = Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ("collection", "command")
+)
+mongo_checkout_wait = Histogram(
+    "mongodb_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled MongoDB connection, by outcome (ok or the failure reason)",
+    ("outcome",),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0),
+)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._collections: Dict[Tuple[Any, int], str] = {}
+
+    def started(self, event):
+        command = event.command
+        target = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe((collection, event.command_name), event.duration_micros / 1e6)
+        record_phase("db", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe((collection, event.command_name), event.duration_micros / 1e6)
+        record_phase("db", event.duration_micros / 1e6)
+        mongo_command_failures.inc((collection, event.command_name))
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+        self.waiting = 0
+        self._lock = threading.Lock()
+        # A checkout starts and ends on the same executor thread
+        self._started = threading.local()
+
+    def _add(self, field: str, delta: int) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def connection_created(self, event):
+        self._add("open", 1)
+
+    def connection_closed(self, event):
+        self._add("open", -1)
+
+    def _waited(self, event) -> float:
+        self._add("waiting", -1)
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7
+        if duration is None:
+            duration = time.perf_counter() - getattr(self._started, "at", time.perf_counter())
+        record_phase("db", duration)
+        return duration
+
+    def connection_check_out_started(self, event):
+        self._add("waiting", 1)
+        self._started.at = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._add("checked_out", 1)
+        mongo_checkout_wait.observe(("ok",), self._waited(event))
+
+    def connection_checked_in(self, event):
+        self._add("checked_out", -1)
+
+    def connection_check_out_failed(self, event):
+        self._add("checkout_failures", 1)
+        mongo_checkout_wait.observe((str(event.reason),), self._waited(event))
+
+    # Events we do not aggregate
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+mongo_commands = MongoCommandMetrics()
+mongo_pool = MongoPoolMetrics()
+
+
+def mongo_event_listeners() -> List[Any]:
+    return [mongo_commands, mongo_pool]
+
+
+GaugeFunc(
+    "mongodb_pool_connections", "MongoDB driver connections by state", ("state",),
+    lambda: {("open",): mongo_pool.open, ("checked_out",): mongo_pool.checked_out},
+)
+GaugeFunc(
+    "mongodb_pool_checkouts_waiting", "Operations waiting for a pooled MongoDB connection", (),
+    lambda: {(): mongo_pool.waiting},
+)
+GaugeFunc(
+    "mongodb_pool_checkout_failures_total", "Failed MongoDB connection checkouts", (),
+    lambda: {(): mongo_pool.checkout_failures}, kind="counter",
+)
+
+# -------------------------------
+# Cross-worker invalidation (app/invalidation.py)
+# -------------------------------
+invalidation_events = Counter(
+    "invalidation_events_total", "Changes applied to this worker's caches", ("collection", "operation")
+)
+invalidation_lag = Histogram(
+    "invalidation_lag_seconds", "Time from a write to this worker applying it", ("collection",)
+)
+
+# -------------------------------
+# bcrypt pool
+# -------------------------------
+def _password_pool_tasks() -> Dict[Tuple[Any, ...], float]:
+    stats = password_pool_stats()
+    return {("in_flight",): stats["in_flight"], ("queued",): stats["queued"]}
+
+
+GaugeFunc(
+    "password_pool_tasks", "bcrypt calls running or waiting for a worker", ("state",),
+    _password_pool_tasks,
+)
+GaugeFunc(
+    "password_pool_rejected_total", "bcrypt calls shed with 503 because the queue was full", (),
+    lambda: {(): password_pool_stats()["rejected"]}, kind="counter",
+)
+GaugeFunc(
+    "password_pool_workers", "Configured bcrypt pool workers", (),
+    lambda: {(): password_pool_stats()["workers"]},
+)
+
+# -------------------------------
+# In-process caches
+# -------------------------------
+def _cache_samples(field: str) -> Callable[[], Dict[Tuple[Any, ...], float]]:
+    return lambda: {(name,): stats[field] for name, stats in cache_stats().items()}
+
+
+GaugeFunc("cache_hits_total", "Cache hits", ("cache",), _cache_samples("hits"), kind="counter")
+GaugeFunc("cache_misses_total", "Cache misses", ("cache",), _cache_samples("misses"), kind="counter")
+GaugeFunc("cache_entries", "Entries currently cached", ("cache",), _cache_samples("size"))
+
+# -------------------------------
+# Server-Sent Events hub
+# -------------------------------
+GaugeFunc("sse_subscribers", "Open /books/events streams", (),
+          lambda: {(): event_hub_stats()["subscribers"]})
+GaugeFunc("sse_events_published_total", "Book events published to at least one stream", (),
+          lambda: {(): event_hub_stats()["published"]}, kind="counter")
+GaugeFunc("sse_overflows_total", "Streams that fell behind and were sent a resync", (),
+          lambda: {(): event_hub_stats()["overflows"]}, kind="counter")
@@ -2,12 +2,31 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError
-from typing import Dict, Any
+from typing import Any, Dict, Optional
+import hashlib
+import time
 
-from app.dependencies import decode_token, users_col, to_object_id, oid_to_str
+from app.cache import TTLCache
+from app.dependencies import (
+    decode_token, users_col, tombstones_col, oid_to_str, user_identity_filter,
+    USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS, AUTH_MODE, TOKEN_CACHE_SIZE,
+    ACCESS_TOKEN_EXPIRE_MINUTES
+)
+from app.profiling import timed_phase
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
+# Normalized user documents keyed by token subject (user_id, or str(_id) for legacy users)
+user_cache = TTLCache("users", maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+def invalidate_cached_user(user: Dict[str, Any]) -> None:
+    """Drop a user from the auth cache under every key a token may carry.
+
+    Accepts a raw document (`_id`) or one already normalized by oid_to_str (`id`).
+    """
+    user_cache.invalidate(user.get("user_id"), str(user.get("_id", user.get("id"))))
+
+@timed_phase("auth")
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
     try:
         payload = decode_token(token)
@@ -17,23 +36,98 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
-    # Try by user_id (new schema)
-    user = await users_col.find_one({"user_id": uid})
-    if not user:
-        # Fallback: treat as legacy ObjectId
-        try:
-            user = await users_col.find_one({"_id": to_object_id(uid)})
-        except Exception:
-            user = None
+    cached = user_cache.get(uid)
+    if cached is not None:
+        return dict(cached)
 
+    user = await users_col.find_one(user_identity_filter(uid))
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
     # Normalize _id => id, keep user_id if present
-    return oid_to_str(user)
+    user = oid_to_str(user)
+    user_cache.set(uid, user)
+    return dict(user)
+
+# -------------------------------
+# Stateless fast path (AUTH_MODE=stateless)
+# -------------------------------
+# Verified claims keyed by sha256(token); each entry expires with its token
+token_cache = TTLCache("tokens", maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+# Token subject -> epoch seconds; tokens issued before it are no longer trusted.
+# Entries older than the token lifetime can never match and are pruned.
+# Rebuilt at startup by `load_revocations`; until then claims are not trusted.
+_revoked_before: Dict[str, float] = {}
+_REVOCATION_PRUNE_AT = 1024
+revocations_loaded = False
+
+def revoke_user_tokens(user: Dict[str, Any], at: Optional[float] = None) -> None:
+    """Stop trusting claims in tokens issued to `user` before `at` (default: now).
+
+    Called on role change or deletion; other workers pass the time of the write.
+    """
+    now = time.time()
+    at = now if at is None else at
+    if len(_revoked_before) >= _REVOCATION_PRUNE_AT:
+        horizon = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        for key in [k for k, ts in _revoked_before.items() if ts < horizon]:
+            del _revoked_before[key]
+    for key in (user.get("user_id"), str(user.get("_id", user.get("id")))):
+        if key:
+            _revoked_before[key] = max(at, _revoked_before.get(key, 0))
+
+async def load_revocations() -> int:
+    """Rebuild revocations from role changes and user deletes within the token lifetime.
+
+    Both are stamped with `seq` (app/changes.py), whose microseconds are the
+    time of the write; a restarted worker would otherwise trust tokens of
+    demoted or deleted users again.
+    """
+    global revocations_loaded
+    horizon = {"$gt": int((time.time() - ACCESS_TOKEN_EXPIRE_MINUTES * 60) * 1e6)}
+    count = 0
+    async for user in users_col.find({"seq": horizon}, {"user_id": 1, "seq": 1}):
+        revoke_user_tokens(user, user["seq"] / 1e6)
+        count += 1
+    async for doc in tombstones_col.find({"collection": "users", "seq": horizon}, {"user_id": 1, "seq": 1}):
+        revoke_user_tokens(doc, doc["seq"] / 1e6)
+        count += 1
+    revocations_loaded = True
+    return count
+
+@timed_phase("auth")
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
+    """Verify a token without touching the database."""
+    key = hashlib.sha256(token.encode()).digest()
+    claims = token_cache.get(key)
+    if claims is None:
+        claims = decode_token(token)
+        if claims.get("sub") is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token: missing user ID")
+        token_cache.set(key, claims, ttl=claims["exp"] - time.time())
+
+    revoked_at = _revoked_before.get(claims["sub"])
+    if revoked_at is not None and claims.get("iat", 0) < revoked_at:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token revoked, please log in again")
+    return claims
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
+    """Who is calling: token claims in stateless mode, the full user document otherwise.
+
+    Until this worker has loaded revocations, stateless mode looks the user up too.
+    """
+    if AUTH_MODE == "stateless" and revocations_loaded:
+        claims = await get_token_claims(token)
+        return {
+            "user_id": claims["sub"],
+            "username": claims.get("username"),
+            "role": claims.get("role", "user"),
+        }
+    return await get_current_user(token)
 
 def require_role(required_role: str):
-    async def role_checker(current_user: Dict[str, Any] = Depends(get_current_user)):
+    async def role_checker(current_user: Dict[str, Any] = Depends(get_current_principal)):
         if current_user.get("role") != required_role:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
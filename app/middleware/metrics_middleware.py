@@ -0,0 +1,40 @@
+# app/middleware/metrics_middleware.py
+import time
+
+from app.metrics import http_request_duration, http_requests_total
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request counts and latency per route template.
+
+    The router stores the matched route in the (shared) scope, so after the
+    request completes `scope["route"].path` is the template, e.g.
+    /api/v1/books/{book_id}. Unmatched paths share one label to keep
+    cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.observe((method, template), time.perf_counter() - start)
+            http_requests_total.inc((method, template, status_code))
@@ -0,0 +1,107 @@
+# app/middleware/profiler_middleware.py
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from app.dependencies import (
+    PROFILER_SAMPLE_RATE, PROFILER_SLOW_MS, PROFILER_INTERVAL_MS, PROFILER_DIR, PROFILER_MAX_FILES
+)
+from app.profiling import StackSampler, instrument_fastapi_serialization, start_phases
+
+
+class ProfilerMiddleware:
+    """Pure ASGI middleware capturing per-request profiles for offline analysis.
+
+    While any request is in flight a sampler thread records event-loop stacks
+    for it. When the request finishes the profile is kept if the request was
+    picked at PROFILER_SAMPLE_RATE or took at least PROFILER_SLOW_MS, and
+    dropped otherwise. Each capture is written to PROFILER_DIR as a pair:
+
+    - <name>.folded: collapsed stacks ("frame;frame;frame count"), ready for
+      flamegraph.pl or speedscope
+    - <name>.json: route, status, latency and the db/auth/serialize breakdown
+
+    Only the newest PROFILER_MAX_FILES captures are kept. Stacks show time the
+    request spent on the event loop; time spent waiting (DB round trips, the
+    bcrypt pool) shows up in the breakdown instead. Phases can overlap: auth
+    includes its user lookup, and concurrent DB calls are summed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.sampler = StackSampler(PROFILER_INTERVAL_MS / 1000)
+        instrument_fastapi_serialization()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _accepts_event_stream(scope):
+            # Long-lived streams would keep the sampler busy and always count as slow
+            await self.app(scope, receive, send)
+            return
+
+        task = asyncio.current_task()
+        sampled = random.random() < PROFILER_SAMPLE_RATE
+        phases = start_phases()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self.sampler.track(task)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            stacks = self.sampler.untrack(task)
+            slow = elapsed_ms >= PROFILER_SLOW_MS
+            if sampled or slow:
+                route = scope.get("route")
+                report = {
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "method": scope["method"],
+                    "route": getattr(route, "path", None) or "unmatched",
+                    "path": scope["path"],
+                    "status": status_code,
+                    "duration_ms": round(elapsed_ms, 3),
+                    "reason": "slow" if slow else "sampled",
+                    "breakdown_ms": {name: round(seconds * 1000, 3) for name, seconds in phases.items()},
+                    "samples": len(stacks),
+                    "interval_ms": PROFILER_INTERVAL_MS,
+                }
+                # File I/O stays off the event loop
+                asyncio.get_running_loop().run_in_executor(None, write_profile, report, stacks)
+
+
+def _accepts_event_stream(scope) -> bool:
+    return any(name == b"accept" and b"text/event-stream" in value for name, value in scope["headers"])
+
+
+def write_profile(report: Dict[str, Any], stacks: List[str]) -> None:
+    os.makedirs(PROFILER_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", report["route"]).strip("_") or "root"
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    base = os.path.join(PROFILER_DIR, f"{stamp}-{report['method']}-{slug}-{int(report['duration_ms'])}ms")
+
+    with open(base + ".folded", "w") as f:
+        for stack, count in Counter(stacks).most_common():
+            f.write(f"{stack} {count}\n")
+    with open(base + ".json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    # Rotate: names start with a UTC timestamp, so lexical order is age order
+    captures = sorted(name[:-5] for name in os.listdir(PROFILER_DIR) if name.endswith(".json"))
+    for name in captures[:max(0, len(captures) - PROFILER_MAX_FILES)]:
+        for ext in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILER_DIR, name + ext))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,91 @@
+# app/passwords.py
+"""bcrypt hashing and verification, run off the event loop in a bounded pool.
+
+A bcrypt round takes hundreds of milliseconds of CPU, which would stall every
+request on the worker if run inline. Work is handed to a thread (default) or
+process pool; once more than PASSWORD_POOL_MAX_QUEUE calls are waiting for a
+worker, new ones are shed with 503 instead of queueing without bound.
+
+Deliberately free of DB/app imports so process-pool workers import it cheaply.
+"""
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+load_dotenv()
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_POOL_KIND = os.getenv("PASSWORD_POOL_KIND", "thread")  # "thread" or "process"
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", "64"))
+
+# Hashes made with a different cost factor are reported as needing an update
+_pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# --- Synchronous primitives (executed inside the pool) ---
+def hash_password_sync(password: str) -> str:
+    return _pwd_context.hash(password)
+
+def verify_and_update_sync(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return _pwd_context.verify_and_update(plain_password, hashed_password)
+
+# --- Bounded pool ---
+_executor: Optional[Executor] = None
+_in_flight = 0
+_rejected = 0
+
+def _get_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        if PASSWORD_POOL_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+async def _run_in_pool(fn: Callable[..., Any], *args: Any) -> Any:
+    global _in_flight, _rejected
+    if _in_flight - PASSWORD_POOL_WORKERS >= PASSWORD_POOL_MAX_QUEUE:
+        _rejected += 1
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication service busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _in_flight -= 1
+
+def password_pool_stats() -> Dict[str, Any]:
+    return {
+        "kind": PASSWORD_POOL_KIND,
+        "workers": PASSWORD_POOL_WORKERS,
+        "in_flight": _in_flight,
+        "queued": max(0, _in_flight - PASSWORD_POOL_WORKERS),
+        "max_queue": PASSWORD_POOL_MAX_QUEUE,
+        "rejected": _rejected,
+    }
+
+def shutdown_password_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+# --- Async API used by the routers ---
+async def get_password_hash(password: str) -> str:
+    return await _run_in_pool(hash_password_sync, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    valid, _ = await _run_in_pool(verify_and_update_sync, plain_password, hashed_password)
+    return valid
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify, and return a replacement hash if the stored one uses an old cost factor."""
+    return await _run_in_pool(verify_and_update_sync, plain_password, hashed_password)
@@ -0,0 +1,123 @@
+# app/profiling.py
+"""Per-request phase timings and a stack sampler for the opt-in request profiler.
+
+`phase()` / `timed_phase()` add wall time to the current request's breakdown
+(db, auth, serialize). The breakdown lives in a ContextVar holding a dict, so
+it is also reachable from Motor's executor threads, which run with a copy of
+the caller's context. Outside a profiled request they cost one ContextVar read.
+
+`StackSampler` is a daemon thread that, every few milliseconds, records the
+stack of the event loop thread and attributes it to the asyncio task running
+at that moment. Only tasks registered by ProfilerMiddleware are kept.
+"""
+import asyncio
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("profile_phases", default=None)
+
+PHASES = ("db", "auth", "serialize")
+
+
+def start_phases() -> Dict[str, float]:
+    timings = dict.fromkeys(PHASES, 0.0)
+    _phases.set(timings)
+    return timings
+
+
+def record_phase(name: str, seconds: float) -> None:
+    timings = _phases.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    if _phases.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
+
+
+def timed_phase(name: str) -> Callable:
+    """Decorator form of `phase` for coroutine functions (FastAPI dependencies included)."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with phase(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _format_stack(frame) -> str:
+    """Collapsed-stack line (root first) as consumed by flamegraph.pl / speedscope."""
+    parts: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+class StackSampler:
+    def __init__(self, interval: float, max_samples_per_task: int = 10000):
+        self.interval = interval
+        self.max_samples_per_task = max_samples_per_task
+        self._stacks: Dict[int, List[str]] = {}  # id(task) -> sampled stacks
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self, task: asyncio.Task) -> None:
+        if self._thread is None:
+            self._loop = task.get_loop()
+            self._loop_thread = threading.get_ident()
+            self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+            self._thread.start()
+        self._stacks[id(task)] = []
+        self._wake.set()
+
+    def untrack(self, task: asyncio.Task) -> List[str]:
+        stacks = self._stacks.pop(id(task), [])
+        if not self._stacks:
+            self._wake.clear()
+        return stacks
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            task = asyncio.current_task(self._loop)
+            frame = sys._current_frames().get(self._loop_thread)
+            if task is not None and frame is not None:
+                stacks = self._stacks.get(id(task))
+                if stacks is not None and len(stacks) < self.max_samples_per_task:
+                    stacks.append(_format_stack(frame))
+            del frame
+            time.sleep(self.interval)
+
+
+def instrument_fastapi_serialization() -> None:
+    """Time FastAPI's response_model validation/serialization as the "serialize" phase.
+
+    `fastapi.routing.serialize_response` is looked up as a module global on
+    every call, so wrapping it once covers every route.
+    """
+    import fastapi.routing
+
+    original = getattr(fastapi.routing, "serialize_response", None)
+    if original is not None and not getattr(original, "_profiled", False):
+        wrapped = timed_phase("serialize")(original)
+        wrapped._profiled = True
+        fastapi.routing.serialize_response = wrapped
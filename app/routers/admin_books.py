@@ -1,10 +1,36 @@
 # app/routers/admin_books.py
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+import codecs
+import csv
+import io
+import json
 
-from app.dependencies import books_col, oid_to_str, to_object_id
+from app import stats
+from app.cache import bump_catalog_version
+from app.changes import next_seq, stamp, tombstone
+from app.events import hub
+from app.dependencies import (
+    books_col, tombstones_col, oid_to_str, to_object_id, fetch_page,
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, EXPORT_BATCH_SIZE,
+    BULK_IMPORT_BATCH_SIZE, BULK_IMPORT_MAX_ERRORS, BULK_IMPORT_CSV_MAX_RECORD_LINES, FAST_JSON
+)
 from app.middleware.auth_middleware import require_role
-from app.schemas import AdminBookCreate, BookUpdate, BookOut, Message
+from app.routers.books import BOOK_SORT_PATTERN, BOOK_STORED_FIELDS
+from app.schemas import (
+    AdminBookCreate, BookUpdate, BookOut, BookPage, Message,
+    BulkImportResult, BulkImportRowError
+)
+from app.search_index import book_index
+from app.serialization import (
+    json_response, shape_book, select_fields, mongo_projection, sparse_rows, sparse_responses,
+    FIELDS_DESCRIPTION
+)
 
 admin_books_router = APIRouter(
     prefix="/api/v1/admin/books",
@@ -13,45 +39,371 @@ admin_books_router = APIRouter(
 # -------------------------------
 # List all books (admin only - monitoring)
 # -------------------------------
-@admin_books_router.get("", response_model=List[BookOut])   # ⬅️ removed trailing slash
-async def list_all_books(admin=Depends(require_role("admin"))):
-    print("helo")
-    cursor = books_col.find({})
-    books = [oid_to_str(doc) async for doc in cursor]
-    return books
+@admin_books_router.get("", response_model=BookPage, responses=sparse_responses(BookOut, "page"))   # ⬅️ removed trailing slash
+async def list_all_books(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="Opaque cursor from a previous page's next_cursor"),
+    sort: str = Query("_id", pattern=BOOK_SORT_PATTERN),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    admin=Depends(require_role("admin")),
+):
+    selected = select_fields(BookOut, fields)
+    docs, next_cursor = await fetch_page(
+        books_col, {}, sort_key=sort, limit=limit, after=after,
+        projection=mongo_projection(selected, BOOK_STORED_FIELDS)
+    )
+    if selected:
+        items = sparse_rows(BookOut, selected, [shape_book(doc) for doc in docs])
+        return json_response({"items": items, "next_cursor": next_cursor})
+    if FAST_JSON:
+        return json_response({"items": [shape_book(doc) for doc in docs], "next_cursor": next_cursor})
+    return {"items": [oid_to_str(doc) for doc in docs], "next_cursor": next_cursor}
+
+# -------------------------------
+# Export whole catalog as a stream (admin only - nightly dumps)
+# -------------------------------
+EXPORT_FIELDS = list(BookOut.model_fields)
+_EXPORT_PROJECTION = {name: 1 for name in EXPORT_FIELDS if name != "id"}
+
+
+async def _export_batches(fmt: str) -> AsyncIterator[str]:
+    """Yield one chunk per cursor batch so memory stays flat."""
+    cursor = books_col.find({}, _EXPORT_PROJECTION, batch_size=EXPORT_BATCH_SIZE)
+    if fmt == "csv":
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        yield buf.getvalue()
+
+    while True:
+        docs = await cursor.to_list(length=EXPORT_BATCH_SIZE)
+        if not docs:
+            break
+        if fmt == "csv":
+            buf.seek(0)
+            buf.truncate(0)
+            writer.writerows(shape_book(doc) for doc in docs)
+            yield buf.getvalue()
+        else:
+            yield "".join(
+                json.dumps(shape_book(doc), ensure_ascii=False, default=str) + "\n"
+                for doc in docs
+            )
+
+
+@admin_books_router.get("/export")
+async def export_books(
+    fmt: str = Query("ndjson", alias="format", pattern=r'^(ndjson|csv)$'),
+    admin=Depends(require_role("admin")),
+):
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_batches(fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="books.{fmt}"'},
+    )
 
 # -------------------------------
 # Add new book (admin only)
 # -------------------------------
-@admin_books_router.post("", response_model=BookOut)   # ⬅️ removed trailing slash
-async def add_book(payload: AdminBookCreate, admin=Depends(require_role("admin"))):
-    book_doc = {
+def build_book_doc(payload: AdminBookCreate) -> Dict[str, Any]:
+    available_copies = payload.total_copies if payload.available_copies is None else payload.available_copies
+    if available_copies > payload.total_copies:
+        raise HTTPException(status_code=400, detail="available_copies cannot exceed total_copies")
+
+    return {
         "title": payload.title,
         "author": payload.author,
-        "genre": getattr(payload, "genre", None),
-        "available": True
+        "genre": payload.genre,
+        "isbn": payload.isbn,
+        "description": payload.description,
+        "total_copies": payload.total_copies,
+        "available_copies": available_copies,
+        "available": available_copies > 0
     }
+
+
+@admin_books_router.post("", response_model=BookOut)   # ⬅️ removed trailing slash
+async def add_book(payload: AdminBookCreate, admin=Depends(require_role("admin"))):
+    book_doc = {**build_book_doc(payload), "seq": next_seq()}
     result = await books_col.insert_one(book_doc)
     book_doc["_id"] = result.inserted_id
+    book_index.add(book_doc)
+    bump_catalog_version()
+    hub.publish_book(book_doc)
+    stats.record(*stats.book_counters(book_doc))
     return oid_to_str(book_doc)
 
+# -------------------------------
+# Bulk import (admin only) - streamed NDJSON or CSV body
+# -------------------------------
+def _isbn_upsert(book_doc: Dict[str, Any]) -> UpdateOne:
+    """Upsert keyed by ISBN. Re-importing refreshes descriptive fields and
+    total_copies but keeps circulation state: available_copies is only
+    clamped to the new total."""
+    total = book_doc["total_copies"]
+    # Pipeline stages read "$..." strings as field paths; row values are data
+    fields = {
+        k: {"$literal": v} for k, v in book_doc.items() if k not in ("available_copies", "available")
+    }
+    fields["available_copies"] = {
+        "$min": [{"$ifNull": ["$available_copies", {"$literal": book_doc["available_copies"]}]}, total]
+    }
+    return UpdateOne(
+        {"isbn": book_doc["isbn"]},
+        [{"$set": fields}, {"$set": {"available": {"$gt": ["$available_copies", 0]}}}],
+        upsert=True,
+    )
+
+
+async def _stream_lines(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def _stream_records(request: Request, fmt: str) -> AsyncIterator[Tuple[int, Any, Optional[str]]]:
+    """Yield (row number, parsed record, parse error) as the body streams in."""
+    row = 0
+    if fmt == "ndjson":
+        async for line in _stream_lines(request):
+            if not line.strip():
+                continue
+            row += 1
+            try:
+                yield row, json.loads(line), None
+            except ValueError as e:
+                yield row, None, f"Invalid JSON: {e}"
+        return
+
+    # A quoted field may span lines. One still open after
+    # BULK_IMPORT_CSV_MAX_RECORD_LINES lines (or at the end of the body) is
+    # taken for a stray quote: its row is rejected and the lines after it are
+    # read again, so a single bad cell costs one row.
+    header: Optional[List[str]] = None
+    stream = _stream_lines(request).__aiter__()
+    replay: Deque[str] = deque()
+    record: List[str] = []  # lines of the record being read
+    while True:
+        line = replay.popleft() if replay else await anext(stream, None)
+        if line is None and not record:
+            break
+        if line is not None:
+            record.append(line)
+            if len(record) > 1 and '"' not in line and len(record) < BULK_IMPORT_CSV_MAX_RECORD_LINES:
+                continue  # no quote on this line, so the open field is still open
+        try:
+            values = _parse_csv_record("\n".join(record) + "\n") if line is not None else None
+        except csv.Error as e:
+            values, error = [], f"Invalid CSV: {e}"
+            if len(record) > 1 and "field limit" in str(e):
+                replay.extendleft(reversed(record[1:]))  # an open field grew past the csv module's limit
+        else:
+            error = None
+            if values is None:
+                if line is not None and len(record) < BULK_IMPORT_CSV_MAX_RECORD_LINES:
+                    continue  # quoted field spans lines; wait for the rest of the record
+                values, error = [], (
+                    "Invalid CSV: unterminated quoted field" if line is None else
+                    f"Invalid CSV: quoted field still open after {len(record)} lines"
+                )
+                replay.extendleft(reversed(record[1:]))
+        record = []
+        if not values and error is None:
+            continue
+        if header is None:
+            if error:
+                yield 0, None, f"CSV header: {error}"
+                return
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if error:
+            yield row, None, error
+            continue
+        # Empty cells fall back to the schema defaults
+        yield row, {name: value for name, value in zip(header, values) if value != ""}, None
+
+
+def _parse_csv_record(record: str) -> Optional[List[str]]:
+    """Values of one CSV record, or None while a quoted field is still open.
+
+    Quoting follows the csv module: a quote inside an unquoted cell
+    (12" Vinyl) is an ordinary character.
+    """
+    try:
+        return next(csv.reader(io.StringIO(record), strict=True), [])
+    except csv.Error as e:
+        if "unexpected end of data" in str(e):
+            return None
+        raise
+
+
+def _format_validation_error(e: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()
+    )
+
+
+@admin_books_router.post("/bulk", response_model=BulkImportResult)
+async def bulk_import_books(
+    request: Request,
+    batch_size: int = Query(BULK_IMPORT_BATCH_SIZE, ge=1, le=10000),
+    admin=Depends(require_role("admin")),
+):
+    """Import books from an NDJSON (default) or CSV (Content-Type: text/csv) body.
+
+    Rows are validated against AdminBookCreate as they arrive and written in
+    unordered bulk batches; rows with an ISBN are upserted by it.
+    """
+    fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    summary = BulkImportResult()
+
+    def record_error(row: int, error: str) -> None:
+        summary.failed += 1
+        if len(summary.errors) < BULK_IMPORT_MAX_ERRORS:
+            summary.errors.append(BulkImportRowError(row=row, error=error))
+        else:
+            summary.errors_truncated = True
+
+    async def flush(batch: List[Tuple[int, Dict[str, Any]]]) -> None:
+        seq = next_seq()
+        for _, doc in batch:
+            doc["seq"] = seq
+        requests = [
+            _isbn_upsert(doc) if doc.get("isbn") else InsertOne(doc) for _, doc in batch
+        ]
+        failed_indexes = set()
+        try:
+            result = await books_col.bulk_write(requests, ordered=False)
+            counts = result.bulk_api_result
+        except BulkWriteError as e:
+            counts = e.details
+            for err in counts.get("writeErrors", []):
+                failed_indexes.add(err["index"])
+                record_error(batch[err["index"]][0], err.get("errmsg", "Write failed"))
+        summary.inserted += counts.get("nInserted", 0)
+        summary.upserted += counts.get("nUpserted", 0)
+        summary.updated += counts.get("nMatched", 0)
+
+        # Keep the search index current: inserted docs got their _id in place,
+        # upserted/updated ones are re-read by ISBN in one query.
+        isbns = []
+        for i, (_, doc) in enumerate(batch):
+            if i in failed_indexes:
+                continue
+            if doc.get("isbn"):
+                isbns.append(doc["isbn"])
+            else:
+                book_index.add(doc)
+        if isbns:
+            async for doc in books_col.find({"isbn": {"$in": isbns}}):
+                book_index.add(doc)
+
+    batch: List[Tuple[int, Dict[str, Any]]] = []
+    async for row, record, parse_error in _stream_records(request, fmt):
+        summary.received += 1
+        if parse_error:
+            record_error(row, parse_error)
+            continue
+        try:
+            batch.append((row, build_book_doc(AdminBookCreate.model_validate(record))))
+        except ValidationError as e:
+            record_error(row, _format_validation_error(e))
+            continue
+        except HTTPException as e:
+            record_error(row, e.detail)
+            continue
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    if summary.inserted or summary.upserted or summary.updated:
+        bump_catalog_version()
+        hub.publish_resync()
+        stats.reconcile_soon()
+    return summary
+
 # -------------------------------
 # Update book (admin only)
 # -------------------------------
+# Stored counters, with the defaults legacy documents are read with (see BORROWABLE)
+_TOTAL = {"$ifNull": ["$total_copies", 1]}
+_AVAILABLE = {"$ifNull": ["$available_copies", {"$cond": [{"$eq": ["$available", False]}, 0, 1]}]}
+
+
+def _counters_update(update_data: Dict[str, Any]) -> Dict[str, Any]:
+    """$set stage for the copy counters, computed against the stored document.
+
+    An explicit available_copies is taken as is (checked against the total by
+    the caller's filter). Otherwise available_copies moves by the change in
+    total_copies and is clamped to [0, total_copies], so copies on loan stay
+    accounted for and no copies that don't exist become borrowable.
+    """
+    total = {"$literal": update_data["total_copies"]} if "total_copies" in update_data else _TOTAL
+    if "available_copies" in update_data:
+        available = {"$literal": update_data["available_copies"]}
+    else:
+        moved = {"$add": [_AVAILABLE, {"$subtract": [total, _TOTAL]}]}
+        available = {"$max": [0, {"$min": [total, moved]}]}
+    return {"total_copies": total, "available_copies": available}
+
+
+def _counters_after(before: Dict[str, Any], update_data: Dict[str, Any]) -> Dict[str, Any]:
+    """The counters `_counters_update` left on `before` (same rules, in Python)."""
+    old_total = before.get("total_copies", 1)
+    old_available = before.get("available_copies", 0 if before.get("available") is False else 1)
+    total = update_data.get("total_copies", old_total)
+    available = update_data.get(
+        "available_copies", max(0, min(total, old_available + total - old_total))
+    )
+    return {"total_copies": total, "available_copies": available, "available": available > 0}
+
+
 @admin_books_router.put("/{book_id}", response_model=BookOut)
 async def update_book(book_id: str, payload: BookUpdate, admin=Depends(require_role("admin"))):
     update_data = {k: v for k, v in payload.dict(exclude_unset=True).items()}
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
+    if update_data.get("available_copies", 0) > update_data.get("total_copies", float("inf")):
+        raise HTTPException(status_code=400, detail="available_copies cannot exceed total_copies")
+
+    query: Dict[str, Any] = {"_id": to_object_id(book_id)}
+    if "available_copies" in update_data and "total_copies" not in update_data:
+        # Checked against the stored total in the same atomic update
+        query["$expr"] = {"$lte": [update_data["available_copies"], _TOTAL]}
 
-    result = await books_col.update_one(
-        {"_id": to_object_id(book_id)},
-        {"$set": update_data}
+    # Descriptive fields are data: $literal keeps "$..." strings from being read as field paths
+    fields = {
+        k: {"$literal": v} for k, v in update_data.items() if k not in ("total_copies", "available_copies")
+    }
+    before = await books_col.find_one_and_update(
+        query,
+        stamp([
+            {"$set": {**fields, **_counters_update(update_data)}},
+            {"$set": {"available": {"$gt": ["$available_copies", 0]}}},
+        ]),
+        return_document=ReturnDocument.BEFORE
     )
-    if result.matched_count == 0:
+    if before is None:
+        if "$expr" in query and await books_col.count_documents({"_id": query["_id"]}, limit=1):
+            raise HTTPException(status_code=400, detail="available_copies cannot exceed total_copies")
         raise HTTPException(status_code=404, detail="Book not found")
 
-    book = await books_col.find_one({"_id": to_object_id(book_id)})
+    book = {**before, **update_data, **_counters_after(before, update_data)}
+    book_index.add(book)
+    bump_catalog_version()
+    hub.publish_book(book)
+    stats.record(*stats.book_counters(before, -1), *stats.book_counters(book))
     return oid_to_str(book)
 
 # -------------------------------
@@ -59,8 +411,13 @@ async def update_book(book_id: str, payload: BookUpdate, admin=Depends(require_r
 # -------------------------------
 @admin_books_router.delete("/{book_id}", response_model=Message)
 async def delete_book(book_id: str, admin=Depends(require_role("admin"))):
-    result = await books_col.delete_one({"_id": to_object_id(book_id)})
-    if result.deleted_count == 0:
+    book = await books_col.find_one_and_delete({"_id": to_object_id(book_id)})
+    if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
+    await tombstones_col.insert_one(tombstone(book))
+    book_index.remove(book_id)
+    bump_catalog_version()
+    hub.publish_deleted(str(book["_id"]))
+    stats.record(*stats.book_counters(book, -1))
     return Message(detail="Book deleted successfully")
 
@@ -0,0 +1,59 @@
+# app/routers/admin_loans.py
+from fastapi import APIRouter, Depends, Query
+from typing import Any, Dict, Optional
+from datetime import datetime, timezone
+
+from app.dependencies import (
+    loans_col, to_object_id, fetch_page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+)
+from app.middleware.auth_middleware import require_role
+from app.schemas import LoanPage
+
+admin_loans_router = APIRouter(
+    prefix="/api/v1/admin/loans",
+    tags=["Admin - Loans"]
+)
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    # The driver returns naive UTC datetimes
+    return value.replace(tzinfo=timezone.utc) if value is not None and value.tzinfo is None else value
+
+
+def shape_loan(doc: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    due_at = _utc(doc["due_at"])
+    return {
+        "id": str(doc["_id"]),
+        "user_id": doc["user_id"],
+        "book_id": str(doc["book_id"]),
+        "borrowed_at": _utc(doc["borrowed_at"]),
+        "due_at": due_at,
+        "returned_at": _utc(doc.get("returned_at")),
+        "active": doc.get("active", False),
+        "overdue": doc.get("active", False) and due_at < now,
+    }
+
+# -------------------------------
+# List active or overdue loans (admin only), earliest due first
+# -------------------------------
+@admin_loans_router.get("", response_model=LoanPage)
+async def list_loans(
+    status: str = Query("active", pattern=r'^(active|overdue)$'),
+    user_id: Optional[str] = Query(None, description="Only this user's loans"),
+    book_id: Optional[str] = Query(None, description="Only loans of this book (who holds it)"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="Opaque cursor from a previous page's next_cursor"),
+    admin=Depends(require_role("admin")),
+):
+    now = datetime.now(timezone.utc)
+    # `active: True` keeps every query on the partial indexes in app/db_indexes.py
+    query: Dict[str, Any] = {"active": True}
+    if status == "overdue":
+        query["due_at"] = {"$lt": now}
+    if user_id:
+        query["user_id"] = user_id
+    if book_id:
+        query["book_id"] = to_object_id(book_id)
+
+    docs, next_cursor = await fetch_page(loans_col, query, sort_key="due_at", limit=limit, after=after)
+    return {"items": [shape_loan(doc, now) for doc in docs], "next_cursor": next_cursor}
@@ -0,0 +1,41 @@
+# app/routers/admin_stats.py
+from fastapi import APIRouter, Depends, Query
+
+from app.dependencies import users_col, canonical_user_id, user_identity_filter
+from app.middleware.auth_middleware import require_role
+from app.schemas import CatalogStats
+from app.stats import read_stats, reconcile_stats
+
+admin_stats_router = APIRouter(
+    prefix="/api/v1/admin/stats",
+    tags=["Admin - Stats"]
+)
+
+# -------------------------------
+# Dashboard counters (admin only) - read from the materialized stats documents
+# -------------------------------
+@admin_stats_router.get("", response_model=CatalogStats)
+async def get_stats(
+    top: int = Query(10, ge=1, le=100),
+    admin=Depends(require_role("admin")),
+):
+    result = await read_stats(top)
+    borrowers = result["top_borrowers"]
+    if borrowers:
+        # Borrower counters are keyed by user id; add usernames in one query
+        cursor = users_col.find(user_identity_filter(*[b["name"] for b in borrowers]), {"username": 1, "user_id": 1})
+        names = {canonical_user_id(user): user.get("username") async for user in cursor}
+        for entry in borrowers:
+            entry["username"] = names.get(entry["name"])
+    return result
+
+# -------------------------------
+# Recompute now instead of waiting for the periodic reconciliation
+# -------------------------------
+@admin_stats_router.post("/reconcile", response_model=CatalogStats)
+async def reconcile(
+    top: int = Query(10, ge=1, le=100),
+    admin=Depends(require_role("admin")),
+):
+    await reconcile_stats()
+    return await get_stats(top=top, admin=admin)
@@ -1,60 +1,164 @@
 # sept 9th
 
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-
-from app.dependencies import users_col, oid_to_str, to_object_id
-from app.middleware.auth_middleware import require_role
-from app.schemas import UserOut, Message, UserRoleUpdate
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+
+from app.changes import insert_tombstones, stamp, user_tombstone
+from app.dependencies import users_col, canonical_user_id, user_identity_filter, FAST_JSON
+from app.loans import borrowed_by_user, release_loans
+from app.middleware.auth_middleware import require_role, invalidate_cached_user, revoke_user_tokens
+from app.serialization import (
+    json_response, select_fields, mongo_projection, sparse_rows, sparse_responses, FIELDS_DESCRIPTION
+)
+from app.schemas import (
+    UserOut, Message, UserRoleUpdate, UserBatchDelete, UserBatchRoleUpdate, UserBatchResult
+)
 
 admin_users_router = APIRouter(
     prefix="/api/v1/admin/users",
     tags=["Admin - Users"]
 )
 
+# UserOut.borrowed_books is read from the loans collection, not the user document
+USER_STORED_FIELDS = {"borrowed_books": ("user_id",)}
+
 # -------------------------------
 # Utility: normalize user
 # -------------------------------
-def normalize_user(user: dict) -> dict:
-    norm = oid_to_str(user)
+def normalize_user(user: dict, borrowed_books: Optional[List[str]] = None) -> dict:
+    """UserOut shape; borrowed_books comes from the loans collection (see with_loans)."""
     return {
-        "user_id": user.get("user_id") or norm["id"],
+        "user_id": canonical_user_id(user),
         "username": user.get("username"),
         "email": user.get("email"),
         "full_name": user.get("full_name"),
         "role": user.get("role", "user"),
-        "borrowed_books": user.get("borrowed_books", [])
+        "borrowed_books": borrowed_books or []
     }
 
 
+async def with_loans(users: List[dict], selected: Optional[Tuple[str, ...]] = None) -> List[dict]:
+    """Normalize users, filling borrowed_books with one loans query when it is wanted."""
+    held: Dict[str, List[str]] = {}
+    if selected is None or "borrowed_books" in selected:
+        held = await borrowed_by_user(canonical_user_id(user) for user in users)
+    return [normalize_user(user, held.get(canonical_user_id(user))) for user in users]
+
+
+# -------------------------------
+# Utility: resolve many ids (UUID or ObjectId) in one query
+# -------------------------------
+async def resolve_users(user_ids: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Return the matching user documents and the ids that matched nothing."""
+    ids = list(dict.fromkeys(user_ids))
+    users = await users_col.find(user_identity_filter(*ids)).to_list(length=None)
+
+    found = {user.get("user_id") for user in users} | {str(user["_id"]) for user in users}
+    return users, [i for i in ids if i not in found]
+
+
+def _split_self(users: List[Dict[str, Any]], admin: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Admins cannot demote or delete themselves; pull the caller out of a batch."""
+    me = {admin.get("user_id"), admin.get("id")} - {None}
+    targets, skipped = [], []
+    for user in users:
+        if me & {user.get("user_id"), str(user["_id"])}:
+            skipped.append(user.get("user_id") or str(user["_id"]))
+        else:
+            targets.append(user)
+    return targets, skipped
+
+
+# -------------------------------
+# Batch role update
+# -------------------------------
+@admin_users_router.post("/batch/role", response_model=UserBatchResult)
+async def batch_update_roles(payload: UserBatchRoleUpdate, admin=Depends(require_role("admin"))):
+    users, not_found = await resolve_users(payload.user_ids)
+    targets, skipped = _split_self(users, admin)
+
+    modified = 0
+    if targets:
+        result = await users_col.update_many(
+            {"_id": {"$in": [user["_id"] for user in targets]}},
+            stamp({"$set": {"role": payload.new_role}})
+        )
+        modified = result.modified_count
+    for user in targets:
+        invalidate_cached_user(user)
+        revoke_user_tokens(user)
+
+    return UserBatchResult(
+        requested=len(payload.user_ids), matched=len(users), modified=modified,
+        not_found=not_found, skipped=skipped
+    )
+
+
+# -------------------------------
+# Batch delete (releases the users' borrowed copies)
+# -------------------------------
+@admin_users_router.post("/batch/delete", response_model=UserBatchResult)
+async def batch_delete_users(payload: UserBatchDelete, admin=Depends(require_role("admin"))):
+    users, not_found = await resolve_users(payload.user_ids)
+    targets, skipped = _split_self(users, admin)
+
+    deleted = released = 0
+    if targets:
+        # An overlapping batch may delete some of the same users: tombstones
+        # already written are skipped and release_loans claims each loan once
+        result = await users_col.delete_many({"_id": {"$in": [user["_id"] for user in targets]}})
+        deleted = result.deleted_count
+        await insert_tombstones([user_tombstone(user, canonical_user_id(user)) for user in targets])
+        released = await release_loans([canonical_user_id(user) for user in targets])
+
+    for user in targets:
+        invalidate_cached_user(user)
+        revoke_user_tokens(user)
+
+    return UserBatchResult(
+        requested=len(payload.user_ids), matched=len(users), deleted=deleted,
+        books_released=released, not_found=not_found, skipped=skipped
+    )
+
+
 # -------------------------------
 # List all users
 # -------------------------------
-@admin_users_router.get("/", response_model=List[UserOut])
-async def list_users(admin=Depends(require_role("admin"))):
-    cursor = users_col.find({})
-    users = []
-    async for doc in cursor:
-        users.append(normalize_user(doc))
+@admin_users_router.get("/", response_model=List[UserOut], responses=sparse_responses(UserOut, "list"))
+async def list_users(
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    admin=Depends(require_role("admin")),
+):
+    selected = select_fields(UserOut, fields)
+    projection = mongo_projection(selected, USER_STORED_FIELDS) or {"password": 0}
+    users = await with_loans(await users_col.find({}, projection).to_list(length=None), selected)
+    if selected:
+        return json_response(sparse_rows(UserOut, selected, users))
+    if FAST_JSON:
+        return json_response(users)
     return users
 
 
 # -------------------------------
 # Get user by user_id (UUID or Mongo ObjectId)
 # -------------------------------
-@admin_users_router.get("/{user_id}", response_model=UserOut)
-async def get_user(user_id: str, admin=Depends(require_role("admin"))):
-    user = await users_col.find_one({"user_id": user_id})
-    if not user:
-        try:
-            user = await users_col.find_one({"_id": to_object_id(user_id)})
-        except Exception:
-            pass
-
+@admin_users_router.get("/{user_id}", response_model=UserOut, responses=sparse_responses(UserOut))
+async def get_user(
+    user_id: str,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    admin=Depends(require_role("admin")),
+):
+    selected = select_fields(UserOut, fields)
+    projection = mongo_projection(selected, USER_STORED_FIELDS)
+    user = await users_col.find_one(user_identity_filter(user_id), projection)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return normalize_user(user)
+    user = (await with_loans([user], selected))[0]
+    if selected:
+        return json_response(sparse_rows(UserOut, selected, [user])[0])
+    return user
 
 
 # -------------------------------
@@ -62,24 +166,18 @@ async def get_user(user_id: str, admin=Depends(require_role("admin"))):
 # -------------------------------
 @admin_users_router.put("/{user_id}", response_model=UserOut)
 async def update_user_role(user_id: str, payload: UserRoleUpdate, admin=Depends(require_role("admin"))):
-    # Try UUID
-    result = await users_col.update_one({"user_id": user_id}, {"$set": {"role": payload.new_role}})
-
-    if result.matched_count == 0:
-        # Try Mongo ObjectId
-        try:
-            result = await users_col.update_one({"_id": to_object_id(user_id)}, {"$set": {"role": payload.new_role}})
-        except Exception:
-            pass
-
-    if result.matched_count == 0:
+    user = await users_col.find_one_and_update(
+        user_identity_filter(user_id),
+        stamp({"$set": {"role": payload.new_role}}),
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Fetch updated user
-    user = await users_col.find_one({"user_id": user_id}) or \
-           await users_col.find_one({"_id": to_object_id(user_id)})
-
-    return normalize_user(user)
+    # Role checks read the cached user; make the next request see the new role
+    invalidate_cached_user(user)
+    revoke_user_tokens(user)
+    return (await with_loans([user]))[0]
 
 
 # -------------------------------
@@ -87,15 +185,13 @@ async def update_user_role(user_id: str, payload: UserRoleUpdate, admin=Depends(
 # -------------------------------
 @admin_users_router.delete("/{user_id}", response_model=Message)
 async def delete_user(user_id: str, admin=Depends(require_role("admin"))):
-    result = await users_col.delete_one({"user_id": user_id})
-
-    if result.deleted_count == 0:
-        try:
-            result = await users_col.delete_one({"_id": to_object_id(user_id)})
-        except Exception:
-            pass
-
-    if result.deleted_count == 0:
+    user = await users_col.find_one_and_delete(user_identity_filter(user_id))
+    if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    await insert_tombstones([user_tombstone(user, canonical_user_id(user))])
+    await release_loans([canonical_user_id(user)])
+
+    invalidate_cached_user(user)
+    revoke_user_tokens(user)
 
     return {"detail": "User deleted successfully"}
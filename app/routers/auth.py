@@ -1,31 +1,32 @@
 #sept 9th update 
 from fastapi import APIRouter, HTTPException, status, Depends
 from app.dependencies import (
-    users_col, get_password_hash, verify_password, create_access_token,
+    users_col, get_password_hash, verify_and_update_password, create_access_token,
     oid_to_str
 )
+from app.loans import borrowed_by_user
 from app.schemas import SignupRequest, LoginRequest, UserOut, TokenResponse
 from app.middleware.auth_middleware import get_current_user
+from pymongo.errors import DuplicateKeyError
 import uuid
 
 auth_router = APIRouter(prefix="/api/v1/auth", tags=["Auth"])
 
 @auth_router.post("/signup", response_model=UserOut)
 async def signup_user(payload: SignupRequest):
-    existing = await users_col.find_one({"username": payload.username})
-    if existing:
-        raise HTTPException(status_code=400, detail="Username already exists")
-
     user_doc = {
         "user_id": str(uuid.uuid4()),
         "username": payload.username,
         "email": payload.email,
         "full_name": payload.full_name,
-        "password": get_password_hash(payload.password),
-        "role": payload.role or "user",
-        "borrowed_books": []
+        "password": await get_password_hash(payload.password),
+        "role": payload.role or "user"
     }
-    await users_col.insert_one(user_doc)
+    # The unique username index (app/db_indexes.py) rejects duplicates atomically
+    try:
+        await users_col.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already exists")
     # ensure consistent shape
     return {
         "user_id": user_doc["user_id"],
@@ -39,13 +40,19 @@ async def signup_user(payload: SignupRequest):
 @auth_router.post("/login", response_model=TokenResponse)
 async def login(payload: LoginRequest):
     user = await users_col.find_one({"username": payload.username})
-    if not user or not verify_password(payload.password, user["password"]):
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    valid, new_hash = await verify_and_update_password(payload.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    if new_hash:
+        # Stored hash uses an old cost factor (BCRYPT_ROUNDS changed); upgrade it
+        await users_col.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
 
     uid = user.get("user_id") if isinstance(user.get("user_id"), str) else oid_to_str(user).get("id")
     role = user.get("role", "user")
 
-    access_token = create_access_token(data={"sub": uid, "role": role})
+    access_token = create_access_token(data={"sub": uid, "role": role, "username": user["username"]})
 
     return {
         "access_token": access_token,
@@ -70,5 +77,5 @@ async def who_am_i(current_user = Depends(get_current_user)):
         "email": current_user.get("email"),
         "full_name": current_user.get("full_name"),
         "role": current_user.get("role", "user"),
-        "borrowed_books": current_user.get("borrowed_books", [])
+        "borrowed_books": (await borrowed_by_user([uid])).get(uid, [])
     }
@@ -1,46 +1,311 @@
 # sept 10th update 2
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Awaitable, Callable, List, Optional
+from bson import ObjectId
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import InsertOneResult
+import asyncio
+import hashlib
 
-from app.dependencies import books_col, users_col, oid_to_str, to_object_id
+from app import stats
+from app.cache import TTLCache, bump_catalog_version, catalog_version
+from app.changes import read_changes, stamp
+from app.events import availability, hub
+from app.dependencies import (
+    books_col, loans_col, oid_to_str, to_object_id, canonical_user_id, fetch_page,
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL_SECONDS, FAST_JSON,
+    FACET_LIMIT, FACET_SEARCH_LIMIT, EVENTS_MAX_IDS
+)
+from app.loans import BORROWABLE, TAKE_COPY, RETURN_COPY, new_loan
 from app.middleware.auth_middleware import get_current_user
-from app.schemas import BookOut, Message
+from app.profiling import phase
+from app.schemas import BookChanges, BookFacets, BookOut, BookPage, Message
+from app.search_index import book_index
+from app.serialization import (
+    dumps, json_response, shape_book, select_fields, mongo_projection, sparse_rows, sparse_responses,
+    FIELDS_DESCRIPTION
+)
 
 books_router = APIRouter(prefix="/api/v1", tags=["Books - User"])
 
 
-# List all books
-@books_router.get("/books", response_model=List[BookOut])
-async def list_books():
-    cursor = books_col.find({})
-    books = [oid_to_str(doc) async for doc in cursor]
-    return books
+# Stored fields behind BookOut fields whose names differ (`id` is `_id`, always returned)
+BOOK_STORED_FIELDS = {"id": ()}
+
+# Sort keys accepted by the book listings (each is paired with _id for keyset paging)
+BOOK_SORT_PATTERN = r'^(_id|title|author|genre)$'
+
+
+# Serialized catalog responses keyed by (catalog version, path, query string)
+catalog_cache = TTLCache("catalog", maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL_SECONDS)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
+
+
+async def catalog_response(request: Request, build: Callable[[], Awaitable[bytes]]) -> Response:
+    """Serve a catalog read from cache with a strong ETag; `build` runs only on a miss.
+
+    The version is read before building, so a write that lands mid-build files
+    the result under a version that is already unreachable.
+    """
+    key = (catalog_version(), request.url.path, request.url.query)
+    entry = catalog_cache.get(key)
+    if entry is None:
+        body = await build()
+        entry = (body, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"')
+        catalog_cache.set(key, entry)
+
+    body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# List books, one keyset page at a time
+@books_router.get("/books", response_model=BookPage, responses=sparse_responses(BookOut, "page"))
+async def list_books(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = Query(None, description="Opaque cursor from a previous page's next_cursor"),
+    sort: str = Query("_id", pattern=BOOK_SORT_PATTERN),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+):
+    selected = select_fields(BookOut, fields)
+
+    async def build() -> bytes:
+        docs, next_cursor = await fetch_page(
+            books_col, {}, sort_key=sort, limit=limit, after=after,
+            projection=mongo_projection(selected, BOOK_STORED_FIELDS)
+        )
+        with phase("serialize"):
+            if selected:
+                items = sparse_rows(BookOut, selected, [shape_book(doc) for doc in docs])
+                return dumps({"items": items, "next_cursor": next_cursor})
+            if FAST_JSON:
+                return dumps({"items": [shape_book(doc) for doc in docs], "next_cursor": next_cursor})
+            page = BookPage(items=[oid_to_str(doc) for doc in docs], next_cursor=next_cursor)
+            return page.model_dump_json().encode()
+
+    return await catalog_response(request, build)
+
+
+def _require_search_index() -> None:
+    # Until the startup build finishes, "no hits" would be indistinguishable from "no matches"
+    if not book_index.ready:
+        raise HTTPException(status_code=503, detail="Search index is still building; try again shortly")
+
+
+# Search books (ranked in-process; must be declared before /books/{book_id})
+@books_router.get("/books/search", response_model=List[BookOut])
+async def search_books(
+    query: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+):
+    _require_search_index()
+    hits = book_index.search(query, limit)
+    if not hits:
+        return []
+
+    cursor = books_col.find({"_id": {"$in": [ObjectId(book_id) for book_id, _ in hits]}})
+    found = {str(doc["_id"]): doc async for doc in cursor}
+    # Keep ranking order; skip ids deleted since they were indexed
+    return [oid_to_str(found[book_id]) for book_id, _ in hits if book_id in found]
+
+
+# Facet counts for the catalog sidebar (must be declared before /books/{book_id})
+def _top(field: str) -> list:
+    return [
+        {"$match": {field: {"$type": "string"}}},
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": FACET_LIMIT},
+        {"$project": {"_id": 0, "name": "$_id", "count": 1}},
+    ]
+
+
+BOOK_FACETS = {
+    "total": [{"$count": "n"}],
+    "genres": _top("genre"),
+    "authors": _top("author"),
+    "availability": [{"$group": {
+        "_id": None,
+        "available": {"$sum": {"$cond": [{"$ne": ["$available", False]}, 1, 0]}},
+        "unavailable": {"$sum": {"$cond": [{"$eq": ["$available", False]}, 1, 0]}},
+    }}],
+}
+
+
+@books_router.get("/books/facets", response_model=BookFacets)
+async def book_facets(
+    request: Request,
+    query: Optional[str] = Query(None, min_length=1, max_length=200, description="Facet over the best FACET_SEARCH_LIMIT search results (see `truncated`)"),
+    genre: Optional[str] = Query(None),
+    author: Optional[str] = Query(None),
+    available: Optional[bool] = Query(None),
+):
+    """Genre/author/availability counts in one $facet aggregation, cached per catalog version."""
+    if query:
+        _require_search_index()
+
+    async def build() -> bytes:
+        match = {}
+        truncated = False
+        if query:
+            hits = book_index.search(query, FACET_SEARCH_LIMIT + 1)
+            truncated = len(hits) > FACET_SEARCH_LIMIT
+            match["_id"] = {"$in": [ObjectId(book_id) for book_id, _ in hits[:FACET_SEARCH_LIMIT]]}
+        if genre:
+            match["genre"] = genre
+        if author:
+            match["author"] = author
+        if available is not None:
+            match["available"] = {"$ne": False} if available else False  # legacy docs lack the flag
+
+        pipeline = ([{"$match": match}] if match else []) + [{"$facet": BOOK_FACETS}]
+        result = (await books_col.aggregate(pipeline).to_list(length=1))[0]
+        with phase("serialize"):
+            return BookFacets(
+                total=result["total"][0]["n"] if result["total"] else 0,
+                genres=result["genres"],
+                authors=result["authors"],
+                availability=result["availability"][0] if result["availability"] else {},
+                truncated=truncated,
+            ).model_dump_json().encode()
+
+    return await catalog_response(request, build)
+
+
+# Delta sync: what changed since a client-held token (must be declared before /books/{book_id})
+@books_router.get("/books/changes", response_model=BookChanges)
+async def book_changes(
+    since: Optional[str] = Query(None, description="next_since from the previous response; omit for a full sync"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    """Books written and ids deleted since `since`, oldest first.
+
+    Keep calling with next_since; has_more means another page is ready now.
+    A 410 means the token is older than the delete history: sync again without one.
+    """
+    changes = await read_changes(since, limit)
+    if FAST_JSON:
+        return json_response({**changes, "items": [shape_book(doc) for doc in changes["items"]]})
+    return {**changes, "items": [oid_to_str(doc) for doc in changes["items"]]}
+
+
+# Availability push over Server-Sent Events (must be declared before /books/{book_id})
+@books_router.get("/books/events", response_class=StreamingResponse,
+                  responses={200: {"content": {"text/event-stream": {}}}})
+async def book_events(
+    ids: Optional[str] = Query(None, description="Comma-separated book ids; omit for the whole catalog"),
+):
+    """Stream `availability` / `deleted` events for the given books.
+
+    Subscribing to ids starts with their current availability. A `resync`
+    event means events were dropped for a slow reader: re-read what you show.
+    """
+    book_ids = None
+    if ids:
+        book_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+        if len(book_ids) > EVENTS_MAX_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {EVENTS_MAX_IDS} ids per stream")
+        oids = [to_object_id(book_id) for book_id in book_ids]
+
+    # Subscribe before reading the snapshot so no change falls in between
+    sub = hub.subscribe(book_ids)
+    initial = []
+    try:
+        if book_ids:
+            projection = {"total_copies": 1, "available_copies": 1, "available": 1}
+            initial = [availability(book) async for book in books_col.find({"_id": {"$in": oids}}, projection)]
+    except BaseException:
+        hub.unsubscribe(sub)
+        raise
+    return StreamingResponse(
+        hub.stream(sub, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(hub.unsubscribe, sub),  # also if the stream never started
+    )
 
 
 # Get book by ID
-@books_router.get("/books/{book_id}", response_model=BookOut)
-async def get_book(book_id: str):
-    book = await books_col.find_one({"_id": to_object_id(book_id)})
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-    return oid_to_str(book)
+@books_router.get("/books/{book_id}", response_model=BookOut, responses=sparse_responses(BookOut))
+async def get_book(
+    book_id: str,
+    request: Request,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+):
+    selected = select_fields(BookOut, fields)
+
+    async def build() -> bytes:
+        book = await books_col.find_one(
+            {"_id": to_object_id(book_id)}, mongo_projection(selected, BOOK_STORED_FIELDS)
+        )
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
+        with phase("serialize"):
+            if selected:
+                return dumps(sparse_rows(BookOut, selected, [shape_book(book)])[0])
+            return BookOut.model_validate(oid_to_str(book)).model_dump_json().encode()
+
+    return await catalog_response(request, build)
 
 
 # Borrow a book (users only)
 @books_router.post("/books/{book_id}/borrow", response_model=Message)
 async def borrow_book(book_id: str, current_user=Depends(get_current_user)):
-    book = await books_col.find_one({"_id": to_object_id(book_id)})
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-    if not book.get("available", True):
-        raise HTTPException(status_code=400, detail="Book is already borrowed")
-
-    # Update book availability
-    await books_col.update_one({"_id": book["_id"]}, {"$set": {"available": False}})
-    # Add to user's borrowed list
-    await users_col.update_one(
-        {"_id": to_object_id(current_user["id"])},
-        {"$addToSet": {"borrowed_books": str(book["_id"])}}
+    book_oid = to_object_id(book_id)
+
+    # Take a copy and open the loan in one round trip. The unique index on
+    # active loans rejects a second loan of the same book; whichever side
+    # fails is rolled back below.
+    book, loan = await asyncio.gather(
+        books_col.find_one_and_update(
+            {"_id": book_oid, **BORROWABLE}, stamp(TAKE_COPY), return_document=ReturnDocument.AFTER
+        ),
+        loans_col.insert_one(new_loan(canonical_user_id(current_user), book_oid)),
+        return_exceptions=True,
+    )
+    already_borrowed = isinstance(loan, DuplicateKeyError)
+    if isinstance(book, Exception) or (isinstance(loan, Exception) and not already_borrowed):
+        # Driver error on one side: undo the other, then surface the error
+        if isinstance(loan, InsertOneResult):
+            await loans_col.delete_one({"_id": loan.inserted_id})
+        if isinstance(book, dict):
+            await books_col.update_one({"_id": book_oid}, stamp(RETURN_COPY))
+            bump_catalog_version()
+        raise book if isinstance(book, Exception) else loan
+
+    # Rejected borrows took no copy: leave the catalog cache alone
+    if book is None:
+        if not already_borrowed:
+            await loans_col.delete_one({"_id": loan.inserted_id})
+        if not await books_col.count_documents({"_id": book_oid}, limit=1):
+            raise HTTPException(status_code=404, detail="Book not found")
+        if already_borrowed:
+            raise HTTPException(status_code=400, detail="You have already borrowed this book")
+        raise HTTPException(status_code=400, detail="No copies available")
+
+    if already_borrowed:
+        await books_col.update_one({"_id": book_oid}, stamp(RETURN_COPY))
+        bump_catalog_version()  # after the rollback, so a mid-way read is not left cached
+        raise HTTPException(status_code=400, detail="You have already borrowed this book")
+
+    bump_catalog_version()
+    hub.publish_book(book)
+    stats.record(
+        stats.catalog(available_copies=-1, active_loans=1),
+        stats.borrower(canonical_user_id(current_user)),
     )
     return Message(detail="Book borrowed successfully")
 
@@ -49,21 +314,31 @@ async def borrow_book(book_id: str, current_user=Depends(get_current_user)):
 # -------------------------------
 @books_router.post("/books/{book_id}/return", response_model=Message)
 async def return_book(book_id: str, current_user=Depends(get_current_user)):
-    book = await books_col.find_one({"_id": to_object_id(book_id)})
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
+    book_oid = to_object_id(book_id)
 
-    # Check if user actually borrowed it
-    if str(book["_id"]) not in current_user.get("borrowed_books", []):
+    # Closing the loan is the guard: only one concurrent return can match it
+    loan = await loans_col.find_one_and_update(
+        {"user_id": canonical_user_id(current_user), "book_id": book_oid, "active": True},
+        {"$set": {"active": False, "returned_at": datetime.now(timezone.utc)}},
+    )
+    if loan is None:
         raise HTTPException(status_code=400, detail="You haven’t borrowed this book")
 
-    # Update book availability
-    await books_col.update_one({"_id": book["_id"]}, {"$set": {"available": True}})
-    # Remove from user's borrowed list
-    await users_col.update_one(
-        {"_id": to_object_id(current_user["id"])},
-        {"$pull": {"borrowed_books": str(book["_id"])}}
-    )
+    book = await books_col.find_one_and_update({"_id": book_oid}, stamp(RETURN_COPY))
+    bump_catalog_version()
+    if book is None:
+        stats.record(stats.catalog(active_loans=-1))
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    # RETURN_COPY never goes above total_copies; `book` is the pre-update document
+    restored = int(book.get("available_copies", 0) < book.get("total_copies", 1))
+    available_copies = book.get("available_copies", 0) + restored
+    hub.publish_book({
+        **book, "total_copies": book.get("total_copies", 1),
+        "available_copies": available_copies, "available": available_copies > 0,
+    })
+    stats.record(stats.catalog(available_copies=restored, active_loans=-1))
+
     return Message(detail="Book returned successfully")
 
 # -------------------------------
@@ -71,10 +346,13 @@ async def return_book(book_id: str, current_user=Depends(get_current_user)):
 # -------------------------------
 @books_router.get("/mybooks", response_model=List[BookOut])
 async def my_books(current_user=Depends(get_current_user)):
-    borrowed_ids = current_user.get("borrowed_books", [])
+    loans = loans_col.find({"user_id": canonical_user_id(current_user), "active": True}, {"book_id": 1})
+    borrowed_ids = [loan["book_id"] async for loan in loans]
     if not borrowed_ids:
         return []
 
-    cursor = books_col.find({"_id": {"$in": [to_object_id(bid) for bid in borrowed_ids]}})
+    cursor = books_col.find({"_id": {"$in": borrowed_ids}})
+    if FAST_JSON:
+        return json_response([shape_book(doc) async for doc in cursor])
     books = [oid_to_str(doc) async for doc in cursor]
     return books
\ No newline at end of file
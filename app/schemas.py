@@ -1,5 +1,6 @@
 # app/schemas.py
 #sept 9th update
+from datetime import datetime
 from typing import List, Optional, Union
 from pydantic import BaseModel, Field, EmailStr
 
@@ -65,6 +66,72 @@ class BookOut(BaseModel):
     class Config:
         from_attributes = True
 
+class BookPage(BaseModel):
+    items: List[BookOut] = []
+    next_cursor: Optional[str] = None
+
+class BookChanges(BaseModel):
+    items: List[BookOut] = []  # added or updated since the token
+    deleted: List[str] = []  # ids of books deleted since the token
+    next_since: str
+    has_more: bool = False
+
+class AvailabilityCounts(BaseModel):
+    available: int = 0
+    unavailable: int = 0
+
+class BookFacets(BaseModel):
+    total: int = 0
+    genres: List["NamedCount"] = []
+    authors: List["NamedCount"] = []
+    availability: AvailabilityCounts = AvailabilityCounts()
+    truncated: bool = False  # with `query`: only the best FACET_SEARCH_LIMIT hits were counted
+
+class BulkImportRowError(BaseModel):
+    row: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    received: int = 0
+    inserted: int = 0
+    upserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: List[BulkImportRowError] = []
+    errors_truncated: bool = False
+
+# ---------- Loan Schemas ----------
+class LoanOut(BaseModel):
+    id: str
+    user_id: str
+    book_id: str
+    borrowed_at: datetime
+    due_at: datetime
+    returned_at: Optional[datetime] = None
+    active: bool
+    overdue: bool = False
+
+class LoanPage(BaseModel):
+    items: List[LoanOut] = []
+    next_cursor: Optional[str] = None
+
+# ---------- Stats Schemas ----------
+class NamedCount(BaseModel):
+    name: str
+    count: int
+
+class BorrowerCount(NamedCount):
+    username: Optional[str] = None
+
+class CatalogStats(BaseModel):
+    titles: int = 0
+    total_copies: int = 0
+    available_copies: int = 0
+    active_loans: int = 0
+    top_genres: List[NamedCount] = []
+    top_borrowers: List[BorrowerCount] = []
+    reconciled_at: Optional[datetime] = None
+
 # ---------- User Schemas ----------
 class UserOut(BaseModel):
     user_id: str
@@ -80,6 +147,21 @@ class AdminUserOut(UserOut):
 class UserRoleUpdate(BaseModel):
     new_role: str = Field(pattern=r'^(user|admin)$')
 
+class UserBatchDelete(BaseModel):
+    user_ids: List[str] = Field(min_length=1, max_length=10000)  # UUIDs or legacy ObjectIds
+
+class UserBatchRoleUpdate(UserBatchDelete):
+    new_role: str = Field(pattern=r'^(user|admin)$')
+
+class UserBatchResult(BaseModel):
+    requested: int
+    matched: int
+    modified: int = 0
+    deleted: int = 0
+    books_released: int = 0
+    not_found: List[str] = []
+    skipped: List[str] = []  # ids resolving to the calling admin
+
 # ---------- Common ----------
 class Message(BaseModel):
     message: str = Field(alias="detail")
@@ -93,3 +175,4 @@ class HealthResponse(BaseModel):
 
 UserOut.model_rebuild()
 AdminUserOut.model_rebuild()
+BookFacets.model_rebuild()
@@ -0,0 +1,152 @@
+# app/search_index.py
+"""In-process inverted index over the book catalog, ranked with BM25.
+
+The index lives in worker memory: it is built by a startup task and kept
+current by the admin book routes, so a search never touches MongoDB until
+the winning ids are fetched by _id. Until the first build completes `ready`
+is False and the search routes answer 503.
+
+A rebuild reads the collection into a fresh index and swaps it in. Books
+added or removed meanwhile are journaled and replayed onto the fresh index
+just before the swap, so they are not lost.
+"""
+import asyncio
+import heapq
+import math
+import re
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Field -> weight applied to every term occurrence in that field
+SEARCH_FIELDS: Dict[str, float] = {
+    "title": 3.0,
+    "author": 2.0,
+    "genre": 1.5,
+    "isbn": 1.0,
+    "description": 1.0,
+}
+_PROJECTION = {field: 1 for field in SEARCH_FIELDS}
+
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from in is it of on or that the this to with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _weighted_terms(doc: Dict[str, Any]) -> Dict[str, float]:
+    terms: Dict[str, float] = {}
+    for field, weight in SEARCH_FIELDS.items():
+        value = doc.get(field)
+        if not value:
+            continue
+        if field == "isbn":
+            # Index ISBNs with dashes stripped so either spelling matches
+            tokens = [re.sub(r"\D", "", str(value))]
+        else:
+            tokens = tokenize(str(value))
+        for token in tokens:
+            terms[token] = terms.get(token, 0.0) + weight
+    return terms
+
+
+class BookSearchIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, float]] = {}  # term -> {book_id: weighted tf}
+        self._doc_terms: Dict[str, Tuple[str, ...]] = {}  # book_id -> its terms (for removal)
+        self._doc_len: Dict[str, float] = {}
+        self._total_len = 0.0
+        self.ready = False
+        # book_id -> indexed fields (None: removed) written during a rebuild
+        self._journal: Optional[Dict[str, Optional[Dict[str, Any]]]] = None
+        self._rebuild_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        """Index (or re-index) one book document; accepts `_id` or `id`."""
+        book_id = str(doc["_id"] if "_id" in doc else doc["id"])
+        if self._journal is not None:
+            self._journal[book_id] = {"_id": book_id, **{f: doc.get(f) for f in SEARCH_FIELDS}}
+        self.remove(book_id, _journal=False)
+        terms = _weighted_terms(doc)
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[book_id] = tf
+        length = sum(terms.values())
+        self._doc_terms[book_id] = tuple(terms)
+        self._doc_len[book_id] = length
+        self._total_len += length
+
+    def remove(self, book_id: str, _journal: bool = True) -> None:
+        if _journal and self._journal is not None:
+            self._journal[book_id] = None
+        terms = self._doc_terms.pop(book_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            del postings[book_id]
+            if not postings:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(book_id)
+
+    def clear(self) -> None:
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_len.clear()
+        self._total_len = 0.0
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[str, float]]:
+        """Return up to `limit` (book_id, score) pairs, best first."""
+        n_docs = len(self._doc_len)
+        if not n_docs:
+            return []
+        avg_len = self._total_len / n_docs or 1.0
+        k1, b = self.k1, self.b
+
+        terms = set(tokenize(query))
+        terms.update(t for t in [re.sub(r"\D", "", query)] if len(t) >= 10)  # bare ISBN query
+
+        scores: Dict[str, float] = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for book_id, tf in postings.items():
+                norm = k1 * (1 - b + b * self._doc_len[book_id] / avg_len)
+                scores[book_id] = scores.get(book_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+    async def rebuild(self, collection, batch_size: int = 1000) -> int:
+        """Re-read the whole collection and swap in the new index contents."""
+        async with self._rebuild_lock:
+            self._journal = {}
+            try:
+                fresh = BookSearchIndex(self.k1, self.b)
+                cursor = collection.find({}, _PROJECTION, batch_size=batch_size)
+                async for doc in cursor:
+                    fresh.add(doc)
+                # No await from here to the swap: nothing can slip in between
+                for book_id, doc in self._journal.items():
+                    if doc is None:
+                        fresh.remove(book_id)
+                    else:
+                        fresh.add(doc)
+            finally:
+                self._journal = None
+            self._postings, self._doc_terms = fresh._postings, fresh._doc_terms
+            self._doc_len, self._total_len = fresh._doc_len, fresh._total_len
+            self.ready = True
+            return len(self)
+
+
+# Module-level singleton shared by the routers and lifespan
+book_index = BookSearchIndex()
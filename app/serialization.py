@@ -0,0 +1,148 @@
+# app/serialization.py
+"""Fast response path for large lists (opt-in with FAST_JSON=true).
+
+By default list endpoints hand plain dicts to FastAPI, which validates every
+row against the response_model and encodes the result. The fast path instead
+projects Mongo documents straight into the output shape (`shape_book`) and
+encodes them with orjson when it is installed. The routes keep their
+response_model, so the OpenAPI schema is unchanged; request bodies and query
+parameters are validated as before.
+
+Documents are trusted to match the output schema: every write goes through a
+validated request model first.
+
+Sparse fieldsets (`?fields=title,author`) are parsed by `select_fields`,
+pushed down to Mongo with `mongo_projection` and rendered by `sparse_rows`,
+which validates only the selected fields. Routes taking `?fields=` document
+their 200 response with `sparse_responses`, where every field is optional.
+"""
+import json
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
+
+from fastapi import HTTPException, Response, status
+from pydantic import BaseModel, Field, create_model
+
+from app.dependencies import FAST_JSON
+from app.schemas import BookOut
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json still skips the per-row models
+    orjson = None
+
+_BOOK_DEFAULTS = {
+    name: field.default for name, field in BookOut.model_fields.items() if name != "id"
+}
+
+
+def shape_book(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a raw book document like BookOut without building a model."""
+    row = {"id": str(doc["_id"])}
+    for name, default in _BOOK_DEFAULTS.items():
+        row[name] = doc.get(name, default)
+    return row
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=str)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    return Response(content=dumps(content), status_code=status_code, media_type="application/json")
+
+
+# --- Sparse fieldsets ---
+FIELDS_DESCRIPTION = "Comma-separated subset of response fields to return, e.g. id,title,author"
+
+
+def select_fields(model: Type[BaseModel], fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Parse `?fields=` against the model's field names (None = whole model)."""
+    if fields is None:
+        return None
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in model.model_fields]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown) or '(none given)'}; "
+                   f"choose from {', '.join(model.model_fields)}"
+        )
+    return names
+
+
+def mongo_projection(
+    fields: Optional[Tuple[str, ...]], renamed: Optional[Dict[str, Iterable[str]]] = None
+) -> Optional[Dict[str, int]]:
+    """Inclusive projection for the selected output fields.
+
+    `renamed` maps output fields to the stored fields they are derived from
+    (BookOut.id is _id, which Mongo returns anyway).
+    """
+    if fields is None:
+        return None
+    renamed = renamed or {}
+    projection: Dict[str, int] = {}
+    for name in fields:
+        for stored in renamed.get(name, (name,)):
+            projection[stored] = 1
+    # {} would mean "no projection" and fetch whole documents
+    return projection or {"_id": 1}
+
+
+@lru_cache(maxsize=256)
+def partial_model(model: Type[BaseModel], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """`model` restricted to `fields`, keeping each field's type and constraints."""
+    return create_model(
+        f"{model.__name__}Fields",
+        **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in fields}
+    )
+
+
+def sparse_rows(model: Type[BaseModel], fields: Tuple[str, ...], rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Cut shaped rows down to `fields` and validate them against the relaxed model."""
+    if FAST_JSON:
+        return [{name: row.get(name) for name in fields} for row in rows]
+    partial = partial_model(model, fields)
+    return [partial.model_validate(row).model_dump(mode="json") for row in rows]
+
+
+@lru_cache(maxsize=None)
+def sparse_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """`model` with every field optional: the shape of a `?fields=` response."""
+    return create_model(
+        f"{model.__name__}Sparse",
+        **{
+            name: (Optional[field.annotation], Field(None, description=field.description))
+            for name, field in model.model_fields.items()
+        }
+    )
+
+
+@lru_cache(maxsize=None)
+def _sparse_page(model: Type[BaseModel]) -> Type[BaseModel]:
+    return create_model(
+        f"{model.__name__}SparsePage",
+        items=(List[sparse_model(model)], []),
+        next_cursor=(Optional[str], None),
+    )
+
+
+def sparse_responses(model: Type[BaseModel], shape: str = "one") -> Dict[int, Dict[str, Any]]:
+    """`responses=` for a route taking `?fields=`: one `model`, a "list" or a keyset "page" of them.
+
+    The route keeps its full response_model; this replaces the documented 200
+    schema so that clients don't treat unselected fields as required.
+    """
+    if shape == "page":
+        sparse = _sparse_page(model)
+    elif shape == "list":
+        sparse = List[sparse_model(model)]
+    else:
+        sparse = sparse_model(model)
+    return {200: {
+        "model": sparse,
+        "description": "Every field unless `fields` selects a subset; then only the selected ones",
+    }}
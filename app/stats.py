@@ -0,0 +1,154 @@
+# app/stats.py
+"""Materialized catalog statistics for the admin dashboard.
+
+Counters live in the small `stats` collection:
+
+    {_id: "catalog", titles, total_copies, available_copies, active_loans, reconciled_at}
+    {_id: "genre:<name>", kind: "genre", name, count}       # titles per genre
+    {_id: "borrower:<user_id>", kind: "borrower", name, count}  # loans ever taken
+
+Write paths report their deltas with `record(...)`, which applies them as
+atomic $inc upserts in one background bulk_write, so the request does not
+wait for it. `reconcile_stats` recomputes everything with aggregation
+pipelines; it runs at startup and every STATS_RECONCILE_SECONDS to correct
+drift (failed counter writes, bulk imports, direct DB edits).
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from pymongo import DESCENDING, UpdateOne
+
+from app.dependencies import books_col, loans_col, stats_col
+
+CATALOG_ID = "catalog"
+COUNTER_FIELDS = ("titles", "total_copies", "available_copies", "active_loans")
+
+_pending: Set[asyncio.Task] = set()
+
+
+# --- Counter updates ---
+def catalog(**deltas: int) -> UpdateOne:
+    return UpdateOne({"_id": CATALOG_ID}, {"$inc": deltas}, upsert=True)
+
+
+def _named(kind: str, name: str, delta: int) -> UpdateOne:
+    return UpdateOne(
+        {"_id": f"{kind}:{name}"},
+        {"$inc": {"count": delta}, "$setOnInsert": {"kind": kind, "name": name}},
+        upsert=True,
+    )
+
+
+def genre(name: Optional[str], delta: int) -> List[UpdateOne]:
+    return [_named("genre", name, delta)] if name else []
+
+
+def borrower(user_id: str, delta: int = 1) -> UpdateOne:
+    return _named("borrower", user_id, delta)
+
+
+def book_counters(book: Dict[str, Any], sign: int = 1) -> List[UpdateOne]:
+    """Deltas for adding (sign=1) or removing (sign=-1) a whole book document."""
+    total = book.get("total_copies", 1)
+    available = book.get("available_copies", 1 if book.get("available", True) else 0)
+    return [
+        catalog(titles=sign, total_copies=sign * total, available_copies=sign * available),
+        *genre(book.get("genre"), sign),
+    ]
+
+
+async def _apply(updates: List[UpdateOne]) -> None:
+    try:
+        await stats_col.bulk_write(updates, ordered=False)
+    except Exception as e:
+        print(f"⚠️ Warning: Could not update stats counters: {e}")
+
+
+def record(*updates: UpdateOne) -> None:
+    """Apply counter updates in the background (drift is fixed by reconcile_stats)."""
+    if not updates:
+        return
+    task = asyncio.get_running_loop().create_task(_apply(list(updates)))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+# --- Reads ---
+async def read_stats(top: int) -> Dict[str, Any]:
+    counters, genres, borrowers = await asyncio.gather(
+        stats_col.find_one({"_id": CATALOG_ID}),
+        stats_col.find({"kind": "genre", "count": {"$gt": 0}}).sort("count", DESCENDING).to_list(length=top),
+        stats_col.find({"kind": "borrower", "count": {"$gt": 0}}).sort("count", DESCENDING).to_list(length=top),
+    )
+    counters = counters or {}
+    return {
+        **{field: counters.get(field, 0) for field in COUNTER_FIELDS},
+        "top_genres": [{"name": doc["name"], "count": doc["count"]} for doc in genres],
+        "top_borrowers": [{"name": doc["name"], "count": doc["count"]} for doc in borrowers],
+        "reconciled_at": counters.get("reconciled_at"),
+    }
+
+
+# --- Reconciliation ---
+async def reconcile_stats() -> Dict[str, Any]:
+    """Recompute every counter from books and loans and overwrite the stats documents."""
+    facets = await books_col.aggregate([
+        {"$facet": {
+            "totals": [{"$group": {
+                "_id": None,
+                "titles": {"$sum": 1},
+                "total_copies": {"$sum": {"$ifNull": ["$total_copies", 1]}},
+                "available_copies": {"$sum": {"$ifNull": [
+                    "$available_copies", {"$cond": [{"$eq": ["$available", False]}, 0, 1]}
+                ]}},
+            }}],
+            "genres": [
+                {"$match": {"genre": {"$type": "string"}}},
+                {"$group": {"_id": "$genre", "count": {"$sum": 1}}},
+            ],
+        }},
+    ]).to_list(length=1)
+    totals = (facets[0]["totals"] or [{}])[0] if facets else {}
+    genres = facets[0]["genres"] if facets else []
+    borrowers = await loans_col.aggregate([
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+    ]).to_list(length=None)
+    active_loans = await loans_col.count_documents({"active": True})
+
+    now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # BSON dates hold milliseconds
+    counters = {field: totals.get(field, 0) for field in COUNTER_FIELDS if field != "active_loans"}
+    counters["active_loans"] = active_loans
+    counters["reconciled_at"] = now
+    await stats_col.replace_one({"_id": CATALOG_ID}, counters, upsert=True)
+
+    # Stamp every recomputed row, then drop rows this run did not produce
+    rows = [("genre", row) for row in genres] + [("borrower", row) for row in borrowers if row["_id"]]
+    if rows:
+        await stats_col.bulk_write([
+            UpdateOne(
+                {"_id": f"{kind}:{row['_id']}"},
+                {"$set": {"kind": kind, "name": row["_id"], "count": row["count"], "reconciled_at": now}},
+                upsert=True,
+            )
+            for kind, row in rows
+        ], ordered=False)
+    await stats_col.delete_many({"kind": {"$in": ["genre", "borrower"]}, "reconciled_at": {"$ne": now}})
+    return counters
+
+
+async def reconcile_periodically(interval: float) -> None:
+    while True:
+        try:
+            await reconcile_stats()
+        except Exception as e:
+            print(f"⚠️ Warning: Stats reconciliation failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def reconcile_soon() -> None:
+    """Schedule a reconciliation after writes whose deltas are not tracked (bulk import)."""
+    task = asyncio.get_running_loop().create_task(reconcile_stats())
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
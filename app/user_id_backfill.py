@@ -0,0 +1,86 @@
+# app/user_id_backfill.py
+"""Backfill `user_id` on legacy user documents (those created before UUIDs).
+
+Legacy tokens carry str(_id) as their subject, so that is the value written:
+existing tokens and borrowed_books keep working, and every user becomes
+addressable by user_id alone. Once the run reports no legacy users left,
+set LEGACY_ID_FALLBACK=false to drop the _id branch from identity lookups.
+
+    python -m app.user_id_backfill                 # run (or resume) the backfill
+    python -m app.user_id_backfill --dry-run       # count legacy users only
+    python -m app.user_id_backfill --restart       # ignore the saved checkpoint
+
+Documents are walked in _id order in batches; after each batch the last _id
+is saved in the `migrations` collection, so an interrupted run resumes where
+it stopped. Each write is conditional on user_id still being unset, so
+reruns and concurrent signups are harmless.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from pymongo import UpdateOne
+
+from app.dependencies import users_col, migrations_col
+
+MIGRATION_ID = "user_id_backfill"
+LEGACY_USERS = {"user_id": {"$not": {"$type": "string"}}}
+
+
+async def backfill_user_ids(batch_size: int = 1000, restart: bool = False) -> Dict[str, Any]:
+    checkpoint = None if restart else await migrations_col.find_one({"_id": MIGRATION_ID})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    updated = checkpoint.get("updated", 0) if checkpoint else 0
+
+    while True:
+        query = dict(LEGACY_USERS)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await users_col.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+
+        result = await users_col.bulk_write([
+            UpdateOne({"_id": doc["_id"], **LEGACY_USERS}, {"$set": {"user_id": str(doc["_id"])}})
+            for doc in batch
+        ], ordered=False)
+        updated += result.modified_count
+        last_id = batch[-1]["_id"]
+        await migrations_col.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"last_id": last_id, "updated": updated, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        print(f"… {updated} users backfilled (through _id {last_id})")
+
+    remaining = await users_col.count_documents(LEGACY_USERS)
+    await migrations_col.update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {"completed_at": datetime.now(timezone.utc), "remaining": remaining}},
+        upsert=True,
+    )
+    return {"updated": updated, "remaining": remaining}
+
+
+async def _main() -> int:
+    parser = argparse.ArgumentParser(description="Backfill user_id on legacy user documents")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="count legacy users, change nothing")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        print(f"ℹ️ Legacy users without user_id: {await users_col.count_documents(LEGACY_USERS)}")
+        return 0
+
+    result = await backfill_user_ids(args.batch_size, args.restart)
+    if result["remaining"]:
+        print(f"⚠️ Backfilled {result['updated']} users; {result['remaining']} still lack user_id, rerun to finish")
+        return 1
+    print(f"✅ Backfilled {result['updated']} users; none left. LEGACY_ID_FALLBACK=false is now safe.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(_main()))
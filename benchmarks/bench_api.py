@@ -0,0 +1,276 @@
+# benchmarks/bench_api.py
+"""In-process API benchmarks.
+
+Drives `app.main.app` through httpx's ASGI transport (no server, no network),
+backed either by an in-memory Motor stand-in (mongomock-motor, default) or a
+local mongod. Each scenario is run sequentially and reported as p50/p95/p99
+latency and ops/sec in one JSON document, so runs can be diffed across commits.
+Catalog reads served through the catalog cache (list_books, get_book) are
+reported twice, labelled cache="hit" and cache="miss" (the catalog version is
+bumped before every request), or once as cache="off" with --no-cache:
+
+    python -m benchmarks.bench_api --output bench-$(git rev-parse --short HEAD).json
+    python -m benchmarks.bench_api --backend mongod --sizes 1000,100000
+
+The mongod backend uses MONGODB_URI (default mongodb://localhost:27017) and a
+dedicated database (--db-name) that is dropped before and after the run.
+Environment must be prepared before the app is imported, hence the late imports.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the Book Management API in-process")
+    parser.add_argument("--backend", choices=["mongomock", "mongod"], default="mongomock")
+    parser.add_argument("--db-name", default="book_mgmt_bench", help="Database used (and dropped) with --backend mongod")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated catalog sizes for the /books scenarios")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="Keeps login from dominating the run")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the user and catalog caches")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    return parser.parse_args()
+
+
+def configure_environment(args: argparse.Namespace) -> None:
+    os.environ["MONGO_DB_NAME"] = args.db_name
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+    os.environ.setdefault("INVALIDATION_MODE", "off")  # one in-process worker
+    if args.no_cache:
+        os.environ["USER_CACHE_TTL_SECONDS"] = "0"
+        os.environ["CATALOG_CACHE_TTL_SECONDS"] = "0"
+    if args.backend == "mongomock":
+        import mongomock_motor
+        import motor.motor_asyncio
+
+        class MockClient(mongomock_motor.AsyncMongoMockClient):
+            def __init__(self, *args: Any, **kwargs: Any):
+                kwargs.pop("event_listeners", None)  # not supported by the stand-in
+                super().__init__()
+
+        motor.motor_asyncio.AsyncIOMotorClient = MockClient
+    sys.path.insert(0, ROOT)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def measure(name: str, call: Callable[[int], Awaitable[Any]], iterations: int, warmup: int,
+                  **labels: Any) -> Dict[str, Any]:
+    for i in range(warmup):
+        await call(i)
+    timings: List[float] = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        await call(i)
+        timings.append(time.perf_counter() - t0)
+    return summarize(name, timings, time.perf_counter() - started, **labels)
+
+
+def summarize(name: str, timings: List[float], total: float, **labels: Any) -> Dict[str, Any]:
+    timings = sorted(timings)
+    return {
+        "name": name,
+        **labels,
+        "iterations": len(timings),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(total / len(timings) * 1000, 3),
+        "ops_per_sec": round(len(timings) / total, 1),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    from app.cache import bump_catalog_version
+    from app.dependencies import books_col, loans_col, get_client
+    from app.main import app
+    from app.search_index import book_index
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    iterations, warmup = args.iterations, args.warmup
+    results: List[Dict[str, Any]] = []
+    catalog_modes = ["off"] if args.no_cache else ["hit", "miss"]
+
+    def expect(status: int) -> Callable[[httpx.Response], httpx.Response]:
+        def check(response: httpx.Response) -> httpx.Response:
+            if response.status_code != status:
+                raise RuntimeError(f"{response.request.method} {response.request.url}: "
+                                   f"{response.status_code} {response.text[:200]}")
+            return response
+        return check
+
+    ok = expect(200)
+    if args.backend == "mongod":
+        await get_client().drop_database(args.db_name)
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await app.state.startup  # indexes and the default admin
+        if args.backend == "mongomock":
+            # mongomock ignores partialFilterExpression, so this unique index
+            # would also match returned loans and reject every re-borrow
+            await loans_col.drop_index("active_user_book_unique")
+        api = "/api/v1"
+        user = {"username": "bench_user", "email": "bench@example.com",
+                "full_name": "Bench User", "password": "bench-password"}
+        ok(await client.post(f"{api}/auth/signup", json=user))
+        login = {"username": user["username"], "password": user["password"]}
+        user_token = ok(await client.post(f"{api}/auth/login", json=login)).json()["access_token"]
+        admin_login = {"username": "admin", "password": "admin123"}
+        admin_token = ok(await client.post(f"{api}/auth/login", json=admin_login)).json()["access_token"]
+        as_user = {"Authorization": f"Bearer {user_token}"}
+        as_admin = {"Authorization": f"Bearer {admin_token}"}
+
+        async def do_login(_: int) -> None:
+            ok(await client.post(f"{api}/auth/login", json=login))
+
+        results.append(await measure("login", do_login, iterations, warmup))
+
+        seeded = 0
+        for size in sizes:
+            docs = [
+                {"title": f"Book {i}", "author": f"Author {i % 500}", "genre": f"Genre {i % 20}",
+                 "isbn": f"978{i:010d}", "description": f"Benchmark book number {i}",
+                 "total_copies": 1_000_000, "available_copies": 1_000_000, "available": True}
+                for i in range(seeded, size)
+            ]
+            if docs:
+                await books_col.insert_many(docs)
+            seeded = size
+            await book_index.rebuild(books_col)
+            bump_catalog_version()
+
+            book_ids = [str(doc["_id"]) async for doc in books_col.find({}, {"_id": 1}).limit(100)]
+
+            async def measure_catalog(name: str, call: Callable[[int], Awaitable[Any]], **labels: Any) -> None:
+                """Time a catalog read from the cache and, separately, from Mongo."""
+                for cache in catalog_modes:
+                    async def timed(i: int, bust: bool = cache == "miss") -> None:
+                        if bust:
+                            bump_catalog_version()
+                        await call(i)
+                    # A hit run warms every URL it will request (get_book cycles book_ids)
+                    primed = max(warmup, len(book_ids)) if cache == "hit" else warmup
+                    results.append(await measure(name, timed, iterations, primed,
+                                                 catalog_size=size, cache=cache, **labels))
+
+            for limit in (50, 500):
+                async def list_books(_: int, limit: int = limit) -> None:
+                    ok(await client.get(f"{api}/books", params={"limit": limit}))
+                await measure_catalog("list_books", list_books, limit=limit)
+
+            async def list_books_sorted(_: int) -> None:
+                ok(await client.get(f"{api}/books", params={"limit": 50, "sort": "title"}))
+            await measure_catalog("list_books", list_books_sorted, limit=50, sort="title")
+
+            async def get_book(i: int) -> None:
+                ok(await client.get(f"{api}/books/{book_ids[i % len(book_ids)]}"))
+            await measure_catalog("get_book", get_book)
+
+            async def search(i: int) -> None:
+                ok(await client.get(f"{api}/books/search", params={"query": f"author {i % 500}"}))
+            results.append(await measure("search_books", search, iterations, warmup, catalog_size=size))
+
+            async def admin_books(_: int) -> None:
+                ok(await client.get(f"{api}/admin/books", params={"limit": 50}, headers=as_admin))
+            results.append(await measure("admin_list_books", admin_books, iterations, warmup,
+                                         catalog_size=size, limit=50))
+
+        # Borrow/return pairs on one book; each half is timed on its own
+        book_id = book_ids[0]
+
+        async def borrow(_: int) -> None:
+            ok(await client.post(f"{api}/books/{book_id}/borrow", headers=as_user))
+
+        async def give_back(_: int) -> None:
+            ok(await client.post(f"{api}/books/{book_id}/return", headers=as_user))
+
+        borrow_times: List[float] = []
+        return_times: List[float] = []
+        for i in range(warmup + iterations):
+            t0 = time.perf_counter()
+            await borrow(i)
+            t1 = time.perf_counter()
+            await give_back(i)
+            t2 = time.perf_counter()
+            if i >= warmup:
+                borrow_times.append(t1 - t0)
+                return_times.append(t2 - t1)
+        results.append(summarize("borrow_book", borrow_times, sum(borrow_times)))
+        results.append(summarize("return_book", return_times, sum(return_times)))
+
+        for book_id in book_ids[1:6]:
+            ok(await client.post(f"{api}/books/{book_id}/borrow", headers=as_user))
+
+        async def my_books(_: int) -> None:
+            ok(await client.get(f"{api}/mybooks", headers=as_user))
+        results.append(await measure("my_books", my_books, iterations, warmup, borrowed=5))
+
+        async def admin_users(_: int) -> None:
+            ok(await client.get(f"{api}/admin/users/", headers=as_admin))
+        results.append(await measure("admin_list_users", admin_users, iterations, warmup))
+
+    if args.backend == "mongod":
+        await get_client().drop_database(args.db_name)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "backend": args.backend,
+            "sizes": sizes,
+            "iterations": iterations,
+            "warmup": warmup,
+            "bcrypt_rounds": args.bcrypt_rounds,
+            "caches": not args.no_cache,
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    configure_environment(args)
+    # The app prints startup progress; keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+# benchmarks/load_generator.py
+"""Scenario-driven load generator for a running Book Management API.
+
+Replays the journey from app/API_testing_examples.py (signup, login, browse,
+search, borrow, return, admin reads) with N concurrent virtual users sharing
+one aiohttp connection pool:
+
+    python -m benchmarks.load_generator --users 200 --duration 60 --ramp-up 10 \\
+        --mix browse=40,search=20,borrow_return=25,my_books=10,admin=5
+
+Setup creates a few "hot" books with very few copies so borrows contend, and
+one account per virtual user. The report (JSON) has throughput, latency and
+error rate per step plus correctness findings:
+
+- oversold: more simultaneous successful loans of a book than it has copies
+- double_borrow: the same user holding one book twice (probed with
+  concurrent borrow requests)
+- audit: after the run, available_copies + loans seen in /mybooks must equal
+  total_copies for every hot book
+
+Expected refusals (no copies left, already borrowed) are counted as
+"rejected", not as errors.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import aiohttp
+
+# Refusals the API is supposed to give under contention
+EXPECTED_REJECTIONS = {
+    "borrow": {400},
+    "double_borrow": {400},
+    "return": {400},
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Concurrent load generator for the Book Management API")
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--users", type=int, default=50, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load after setup")
+    parser.add_argument("--ramp-up", type=float, default=5, help="Seconds over which users start")
+    parser.add_argument("--mix", default="browse=40,search=20,borrow_return=25,my_books=10,admin=5",
+                        help="Weighted scenario mix, name=weight,...")
+    parser.add_argument("--connections", type=int, default=100, help="Size of the shared connection pool")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between scenarios (s)")
+    parser.add_argument("--hot-books", type=int, default=5)
+    parser.add_argument("--hot-copies", type=int, default=3)
+    parser.add_argument("--admin-user", default="admin")
+    parser.add_argument("--admin-password", default="admin123")
+    parser.add_argument("--keep", action="store_true", help="Keep the load-test users and books afterwards")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    return parser.parse_args()
+
+
+def parse_mix(mix: str) -> Tuple[List[str], List[float]]:
+    names, weights = [], []
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        names.append(name.strip())
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.ok: Dict[str, int] = defaultdict(int)
+        self.rejected: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.error_samples: Dict[str, List[str]] = defaultdict(list)
+
+    def record(self, step: str, status: Optional[int], elapsed: float, detail: str = "") -> str:
+        self.latencies[step].append(elapsed)
+        if status is not None and 200 <= status < 300:
+            self.ok[step] += 1
+            return "ok"
+        if status in EXPECTED_REJECTIONS.get(step, ()):
+            self.rejected[step] += 1
+            return "rejected"
+        self.errors[step] += 1
+        if len(self.error_samples[step]) < 5:
+            self.error_samples[step].append(f"{status}: {detail[:200]}")
+        return "error"
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        steps = {}
+        for step, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            count = len(latencies)
+            steps[step] = {
+                "count": count,
+                "ok": self.ok[step],
+                "rejected": self.rejected[step],
+                "errors": self.errors[step],
+                "error_rate": round(self.errors[step] / count, 4),
+                "throughput_rps": round(count / elapsed, 2),
+                "p50_ms": round(latencies[int(0.50 * (count - 1))] * 1000, 2),
+                "p95_ms": round(latencies[int(0.95 * (count - 1))] * 1000, 2),
+                "p99_ms": round(latencies[int(0.99 * (count - 1))] * 1000, 2),
+                "error_samples": self.error_samples[step],
+            }
+        return steps
+
+
+class LoanLedger:
+    """Client-side view of who holds which hot book.
+
+    A loan is added when the borrow response arrives and removed when the
+    return request is sent, so the ledger never counts more loans than the
+    server has granted: exceeding total copies here is a real oversell.
+    """
+
+    def __init__(self, copies: Dict[str, int]):
+        self.copies = copies
+        self.holders: Dict[str, Set[str]] = defaultdict(set)
+        self.violations: List[Dict[str, Any]] = []
+
+    def borrowed(self, book_id: str, user: str) -> None:
+        if user in self.holders[book_id]:
+            self.violations.append({"type": "double_borrow", "book_id": book_id, "user": user})
+        self.holders[book_id].add(user)
+        if len(self.holders[book_id]) > self.copies[book_id]:
+            self.violations.append({
+                "type": "oversold", "book_id": book_id,
+                "holders": len(self.holders[book_id]), "total_copies": self.copies[book_id],
+            })
+
+    def returning(self, book_id: str, user: str) -> None:
+        self.holders[book_id].discard(user)
+
+
+class VirtualUser:
+    def __init__(self, run: "LoadRun", username: str, token: str, admin: bool = False):
+        self.run = run
+        self.username = username
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.admin = admin
+        self.holding: Set[str] = set()
+
+    async def call(self, step: str, method: str, path: str, **kwargs: Any) -> Tuple[str, Any]:
+        start = time.perf_counter()
+        try:
+            async with self.run.session.request(
+                method, self.run.base_url + path, headers=self.headers, **kwargs
+            ) as resp:
+                body = await resp.json(content_type=None)
+                status = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            self.run.stats.record(step, None, time.perf_counter() - start, repr(e))
+            return "error", None
+        outcome = self.run.stats.record(step, status, time.perf_counter() - start, json.dumps(body))
+        return outcome, body
+
+    # --- Scenarios (mirror the steps of API_testing_examples.py) ---
+    async def browse(self) -> None:
+        outcome, page = await self.call("list_books", "GET", "/books", params={"limit": "50"})
+        if outcome != "ok":
+            return
+        if page.get("next_cursor"):
+            await self.call("list_books_next", "GET", "/books",
+                            params={"limit": "50", "after": page["next_cursor"]})
+        if page["items"]:
+            book = random.choice(page["items"])
+            await self.call("get_book", "GET", f"/books/{book['id']}")
+
+    async def search(self) -> None:
+        await self.call("search", "GET", "/books/search", params={"query": random.choice(self.run.search_terms)})
+
+    async def borrow_return(self) -> None:
+        book_id = random.choice(self.run.hot_book_ids)
+        if book_id in self.holding:
+            await self.give_back(book_id)
+            return
+        if random.random() < 0.1:
+            # Fire two borrows at once; at most one may succeed
+            results = await asyncio.gather(*(self.call("double_borrow", "POST", f"/books/{book_id}/borrow")
+                                             for _ in range(2)))
+            granted = sum(1 for outcome, _ in results if outcome == "ok")
+            if granted > 1:
+                self.run.ledger.violations.append({"type": "double_borrow", "book_id": book_id, "user": self.username})
+        else:
+            outcome, _ = await self.call("borrow", "POST", f"/books/{book_id}/borrow")
+            granted = 1 if outcome == "ok" else 0
+        if not granted:
+            return
+        self.run.ledger.borrowed(book_id, self.username)
+        self.holding.add(book_id)
+        await self.call("my_books", "GET", "/mybooks")
+        await self.give_back(book_id)
+
+    async def give_back(self, book_id: str) -> None:
+        self.run.ledger.returning(book_id, self.username)
+        outcome, _ = await self.call("return", "POST", f"/books/{book_id}/return")
+        if outcome != "error":
+            self.holding.discard(book_id)
+
+    async def my_books(self) -> None:
+        await self.call("my_books", "GET", "/mybooks")
+
+    async def admin_reads(self) -> None:
+        headers, self.headers = self.headers, self.run.admin_headers
+        try:
+            await self.call("admin_list_books", "GET", "/admin/books", params={"limit": "50"})
+            await self.call("admin_list_users", "GET", "/admin/users/")
+        finally:
+            self.headers = headers
+
+
+SCENARIOS = {
+    "browse": VirtualUser.browse,
+    "search": VirtualUser.search,
+    "borrow_return": VirtualUser.borrow_return,
+    "my_books": VirtualUser.my_books,
+    "admin": VirtualUser.admin_reads,
+}
+
+
+class LoadRun:
+    def __init__(self, args: argparse.Namespace, session: aiohttp.ClientSession):
+        self.args = args
+        self.session = session
+        self.base_url = args.base_url.rstrip("/")
+        self.stats = Stats()
+        self.tag = uuid.uuid4().hex[:8]
+        self.hot_book_ids: List[str] = []
+        self.search_terms = ["gatsby", "orwell", "classic", "fiction", f"load {self.tag}"]
+        self.admin_headers: Dict[str, str] = {}
+        self.ledger = LoanLedger({})
+        self.users: List[VirtualUser] = []
+        self.user_ids: List[str] = []
+
+    async def expect(self, method: str, path: str, headers: Optional[Dict[str, str]] = None,
+                     **kwargs: Any) -> Any:
+        async with self.session.request(method, self.base_url + path, headers=headers, **kwargs) as resp:
+            body = await resp.json(content_type=None)
+            if resp.status != 200:
+                raise SystemExit(f"Setup failed: {method} {path} -> {resp.status} {body}")
+            return body
+
+    async def setup(self) -> None:
+        admin = await self.expect("POST", "/auth/login",
+                                  json={"username": self.args.admin_user, "password": self.args.admin_password})
+        self.admin_headers = {"Authorization": f"Bearer {admin['access_token']}"}
+
+        copies = {}
+        for i in range(self.args.hot_books):
+            book = await self.expect("POST", "/admin/books", headers=self.admin_headers, json={
+                "title": f"Load {self.tag} hot book {i}",
+                "author": "Load Generator",
+                "genre": "Load Test",
+                "description": f"Contention target for load run {self.tag}",
+                "total_copies": self.args.hot_copies,
+            })
+            copies[book["id"]] = self.args.hot_copies
+        self.hot_book_ids = list(copies)
+        self.ledger = LoanLedger(copies)
+
+        async def create_user(i: int) -> VirtualUser:
+            credentials = {"username": f"load_{self.tag}_{i}", "password": "load-password"}
+            created = await self.expect("POST", "/auth/signup", json={
+                **credentials, "email": f"load_{self.tag}_{i}@example.com", "full_name": f"Load User {i}",
+            })
+            self.user_ids.append(created["user_id"])
+            login = await self.expect("POST", "/auth/login", json=credentials)
+            return VirtualUser(self, credentials["username"], login["access_token"])
+
+        # Signup/login are bcrypt-bound; create accounts in modest waves
+        for start in range(0, self.args.users, 20):
+            self.users += await asyncio.gather(
+                *(create_user(i) for i in range(start, min(start + 20, self.args.users)))
+            )
+
+    async def virtual_user(self, user: VirtualUser, delay: float, deadline: float,
+                           names: List[str], weights: List[float]) -> None:
+        await asyncio.sleep(delay)
+        while time.monotonic() < deadline:
+            scenario = random.choices(names, weights)[0]
+            await SCENARIOS[scenario](user)
+            if self.args.think_time:
+                await asyncio.sleep(random.expovariate(1 / self.args.think_time))
+        for book_id in list(user.holding):
+            await user.give_back(book_id)
+
+    async def audit(self) -> List[Dict[str, Any]]:
+        """available_copies + loans visible in /mybooks must equal total_copies."""
+        loans: Dict[str, int] = defaultdict(int)
+
+        async def count_loans(user: VirtualUser) -> None:
+            async with self.session.get(self.base_url + "/mybooks", headers=user.headers) as resp:
+                for book in await resp.json():
+                    loans[book["id"]] += 1
+
+        await asyncio.gather(*(count_loans(user) for user in self.users))
+        findings = []
+        for book_id in self.hot_book_ids:
+            book = await self.expect("GET", f"/books/{book_id}")
+            available, total = book.get("available_copies"), book.get("total_copies")
+            if available is None or not 0 <= available <= total or available + loans[book_id] != total:
+                findings.append({
+                    "type": "audit_mismatch", "book_id": book_id, "available_copies": available,
+                    "total_copies": total, "loans_seen": loans[book_id],
+                })
+        return findings
+
+    async def cleanup(self) -> None:
+        if self.user_ids:
+            await self.expect("POST", "/admin/users/batch/delete", headers=self.admin_headers,
+                              json={"user_ids": self.user_ids})
+        for book_id in self.hot_book_ids:
+            await self.expect("DELETE", f"/admin/books/{book_id}", headers=self.admin_headers)
+
+    async def execute(self) -> Dict[str, Any]:
+        names, weights = parse_mix(self.args.mix)
+        await self.setup()
+
+        started = time.monotonic()
+        deadline = started + self.args.ramp_up + self.args.duration
+        step = self.args.ramp_up / max(1, len(self.users))
+        await asyncio.gather(*(
+            self.virtual_user(user, i * step, deadline, names, weights) for i, user in enumerate(self.users)
+        ))
+        elapsed = time.monotonic() - started
+
+        audit = await self.audit()
+        if not self.args.keep:
+            await self.cleanup()
+
+        total = sum(len(latencies) for latencies in self.stats.latencies.values())
+        errors = sum(self.stats.errors.values())
+        return {
+            "config": {key: value for key, value in vars(self.args).items() if key != "admin_password"},
+            "run_tag": self.tag,
+            "elapsed_seconds": round(elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(total / elapsed, 2),
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "steps": self.stats.report(elapsed),
+            "violations": self.ledger.violations + audit,
+        }
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await LoadRun(args, session).execute()
+
+
+def main() -> None:
+    args = parse_args()
+    parse_mix(args.mix)  # fail fast on typos
+    report = asyncio.run(main_async(args))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if report["violations"]:
+        print(f"{len(report['violations'])} correctness violation(s) detected", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()